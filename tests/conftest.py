@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Shared fixtures: the modules of the app are imported from the repository
+root, datasets are written in a temporary directory.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import visitor_bench
+
+
+@pytest.fixture
+def visitors():
+
+    # 50 synthetic visitors with the columns of the form
+    return visitor_bench.synthetic_visitors(50)
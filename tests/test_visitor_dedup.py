@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Duplicate visitors: normalized keys, index lookups and merge groups.
+"""
+import threading
+
+import pandas as pd
+
+import visitor_dedup
+
+
+def frame(rows):
+
+    return pd.DataFrame(rows, columns=['farm', 'name', 'zip', 'sales', 'date', 'mobile'])
+
+
+def test_keys():
+
+    assert visitor_dedup.farm_key('GAEC de la Ferme du Bois-Joli') == 'bois joli'
+    assert visitor_dedup.mobile_key('+33 6 12 34 56 78') == visitor_dedup.mobile_key('06.12.34.56.78') == '612345678'
+    assert visitor_dedup.mobile_key('1234') == ''
+    assert visitor_dedup.zip_key(1000) == '01000'
+    assert visitor_dedup.farm_key(None) == visitor_dedup.mobile_key(float('nan')) == ''
+
+
+def test_similar():
+
+    assert visitor_dedup.similar('bois joli', 'bois jolie')
+    assert not visitor_dedup.similar('ferme 12', 'ferme 13')
+    assert not visitor_dedup.similar('f1', 'f10')
+
+
+def test_index_find():
+
+    index = visitor_dedup.build_index(frame([
+        ['GAEC du Bois Joli', 'A', '35000', 'Marine', None, '0612345678'],
+        ['EARL Kerhir', 'B', '29000', 'Fabien', None, None],
+    ]))
+
+    assert [row['name'] for row in index.find('Bois Jolie', None, '35000')] == ['A']
+    assert [row['name'] for row in index.find('Autre nom', '+33612345678', '44000')] == ['A']
+    assert index.find('Bois Joli', None, '29000') == []
+    assert [row['name'] for row in index.find('Kerhir', None, 29000)] == ['B']
+
+
+def test_groups_are_transitive():
+
+    # 0 and 1 share a mobile, 1 and 2 a farm name: one farm
+    df = frame([
+        ['Ferme Martin', 'A', '35000', 'Marine', None, '0612345678'],
+        ['GAEC des Prés', 'B', '29000', 'Fabien', None, '06 12 34 56 78'],
+        ['EARL des Prés', 'C', '29000', 'Sophie', None, None],
+        ['GAEC des Prés', 'D', '35000', 'Sophie', None, None],
+    ])
+
+    groups = visitor_dedup.duplicate_groups(df)
+
+    assert groups[0] == groups[1] == groups[2] != groups[3]
+
+    merged = visitor_dedup.deduplicate(df)
+
+    assert list(merged['name']) == ['A', 'D']
+    assert list(merged['records']) == [3, 1]
+
+
+def test_find_while_adding():
+
+    # The queue worker adds visitors while sessions search the same postal code block
+    index = visitor_dedup.DuplicateIndex()
+    errors = []
+
+    def add():
+        for i in range(20000):
+            index.add({'farm': f'Ferme {i}', 'zip': '35000', 'mobile': None})
+
+    def find():
+        try:
+            for _ in range(200):
+                index.find('Ferme du Bois', None, '35000')
+        except RuntimeError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=add), threading.Thread(target=find)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(index.rows) == 20000
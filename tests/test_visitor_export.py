@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Exports must be accepted by st.download_button, which calls them on click.
+"""
+import gzip
+import io
+
+import pandas as pd
+import pytest
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+import visitor_store
+
+
+@pytest.mark.parametrize('export_format', ['CSV', 'CSV (gzip)', 'Parquet'])
+def test_export_accepted_by_download_button(tmp_path, visitors, export_format):
+
+    path = str(tmp_path / 'visitors.csv')
+    visitor_store.open_store(path).write_base(visitors)
+
+    if export_format == 'Parquet' and visitor_store.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+
+    data, mime = convert_data_to_bytes_and_infer_mime(visitor_store.open_export([path], export_format),
+                                                      RuntimeError('unsupported type'))
+
+    if export_format == 'CSV (gzip)':
+        data = gzip.decompress(data)
+
+    if export_format == 'Parquet':
+        assert len(pd.read_parquet(io.BytesIO(data))) == len(visitors)
+    else:
+        assert len(data.decode('utf-8').splitlines()) == len(visitors) + 1
+
+
+def test_export_filtered(tmp_path, visitors):
+
+    path = str(tmp_path / 'visitors.csv')
+    visitor_store.open_store(path).write_base(visitors)
+
+    data = visitor_store.open_export([path], filters={'sales': ['Fabien']}).getvalue()
+
+    assert len(data.decode('utf-8').splitlines()) == (visitors['sales'] == 'Fabien').sum() + 1
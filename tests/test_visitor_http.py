@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Outbound HTTP against a local server: kept-alive connections, retries and
+the circuit breaker.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import visitor_http
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' # Keep-alive
+
+    def do_GET(self):
+
+        # Answers of each path in turn, the last one is repeated
+        answers = self.server.answers.setdefault(self.path, [(200, {})])
+        status, headers = answers.pop(0) if len(answers) > 1 else answers[0]
+        self.server.calls.append((self.path, self.client_address[1]))
+
+        body = b'{"ok": true}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+
+    monkeypatch.setattr(visitor_http, 'BACKOFF', 0.01)
+    visitor_http.reset()
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.answers = {}
+    httpd.calls = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    yield httpd
+
+    visitor_http.reset()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connection_is_kept_alive(server):
+
+    for _ in range(3):
+        assert visitor_http.get_json(server.url + '/search') == {'ok': True}
+
+    # The three calls went through the same client connection
+    assert len({port for path, port in server.calls}) == 1
+
+
+def test_retry_on_503(server):
+
+    server.answers['/search'] = [(503, {}), (503, {}), (200, {})]
+
+    assert visitor_http.get(server.url + '/search').status_code == 200
+    assert len(server.calls) == 3
+
+    # Past RETRIES the host answer is an error
+    server.answers['/busy'] = [(503, {})]
+
+    with pytest.raises(visitor_http.Unavailable):
+        visitor_http.get(server.url + '/busy')
+
+    assert len(server.calls) == 3 + visitor_http.RETRIES + 1
+
+
+def test_retry_after_is_followed(server):
+
+    server.answers['/search'] = [(503, {'Retry-After': '0.4'}), (200, {})]
+
+    started = time.monotonic()
+    assert visitor_http.get(server.url + '/search').status_code == 200
+
+    assert time.monotonic() - started >= 0.4
+    assert len(server.calls) == 2
+
+
+def test_breaker_opens_then_half_opens(server):
+
+    url = server.url + '/search'
+    breaker, slots = visitor_http._host(url)
+    breaker.cooldown = 0.3
+    server.answers['/search'] = [(503, {})]
+
+    for _ in range(visitor_http.BREAKER_FAILURES):
+        with pytest.raises(visitor_http.Unavailable):
+            visitor_http.get(url, retries=0)
+
+    # Open: the calls fail at once without reaching the host
+    with pytest.raises(visitor_http.Unavailable):
+        visitor_http.get(url, retries=0)
+
+    assert len(server.calls) == visitor_http.BREAKER_FAILURES
+
+    # Half open after the cooldown: a failed trial call keeps the circuit open
+    time.sleep(0.35)
+
+    with pytest.raises(visitor_http.Unavailable):
+        visitor_http.get(url, retries=0)
+    with pytest.raises(visitor_http.Unavailable):
+        visitor_http.get(url, retries=0)
+
+    assert len(server.calls) == visitor_http.BREAKER_FAILURES + 1
+
+    # A successful trial call closes it again
+    time.sleep(0.35)
+    server.answers['/search'] = [(200, {})]
+
+    assert visitor_http.get(url, retries=0).status_code == 200
+    assert visitor_http.get(url, retries=0).status_code == 200
+    assert len(server.calls) == visitor_http.BREAKER_FAILURES + 3
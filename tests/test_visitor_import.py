@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Bulk import: validation of uploaded files and duplicate rejection.
+"""
+import pandas as pd
+import pytest
+
+import visitor_dedup
+import visitor_geo
+import visitor_import
+
+EQT = ['TPA', 'Epi', 'Roto', 'Robot', 'Autre']
+BRANDS = ['Delaval', 'Fullwood', 'GEA', 'Lely', 'Autre']
+PRODUCTS = ['M²erlin', 'Barn-E', 'Nano', 'Moov', 'Racleur', 'Autre']
+ZIP_INDEX = {'35000': ['Rennes'], '20000': ['Ajaccio'], '20600': ['Bastia'], '97400': ['Saint-Denis']}
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+
+    # Postal codes come from ZIP_INDEX, coordinates from nowhere
+    monkeypatch.setattr(visitor_geo, 'lookup_zip', lambda index, zip, timeout=None: index.get(zip, []))
+    monkeypatch.setattr(visitor_geo, 'cached_geocode', lambda address, zip, city: (None, None))
+
+
+def prepare(text, index=None):
+
+    df = visitor_import.read_upload(text.encode('utf-8'), 'visiteurs.csv')
+
+    return visitor_import.prepare_import(df, index, ZIP_INDEX, EQT, BRANDS, PRODUCTS, sales='Fabien')
+
+
+def test_missing_columns():
+
+    valid, rejected = prepare('zip;city;sales\n35000;Rennes;Marine\n')
+
+    assert len(valid) == 0
+    assert list(rejected['motif']) == ['Elevage manquant']
+
+
+def test_valid_rows_are_normalized():
+
+    valid, rejected = prepare('farm;zip;mobile;eqt;brand;product\n'
+                              'GAEC du Bois;35000;0612345678;roto;lely;"nano, Moov"\n'
+                              'EARL des Prés;1000;;citerne;;\n')
+
+    assert len(rejected) == 0
+    assert list(valid['zip']) == ['35000', '01000']
+    assert list(valid['dept']) == ['35', '01']
+    assert list(valid['sales']) == ['Fabien', 'Fabien']
+    assert list(valid['eqt']) == ['Roto', 'Autre']
+    assert valid['product'].iloc[0] == ['Moov', 'Nano']
+    assert valid['city'].iloc[0] == 'Rennes'
+
+
+def test_departments():
+
+    valid, rejected = prepare('farm;zip;dept\n'
+                              'Ferme A;20000;2A\n'
+                              'Ferme B;20600;\n'
+                              'Ferme C;97400;974\n'
+                              'Ferme D;35000;29\n'
+                              'Ferme E;F-35;\n')
+
+    assert list(valid['dept']) == ['2A', '2B', '974']
+    assert list(rejected['motif']) == ['Département différent du code postal', 'Code postal erroné']
+
+
+def test_duplicates_in_file():
+
+    # Same mobile under another name, and a typo in the farm name of the same postal code
+    valid, rejected = prepare('farm;zip;mobile\n'
+                              'GAEC du Bois Joli;35000;0612345678\n'
+                              'Ferme Martin;29000;06 12 34 56 78\n'
+                              'EARL du Bois Jolie;35000;\n'
+                              'EARL du Bois Joli;29000;\n')
+
+    assert list(valid['farm']) == ['GAEC du Bois Joli', 'EARL du Bois Joli']
+    assert list(rejected['motif']) == ['En double dans le fichier', 'En double dans le fichier']
+
+
+def test_duplicates_already_recorded():
+
+    existing = pd.DataFrame({'farm': ['GAEC de Kerhir'], 'name': ['X'], 'zip': ['35000'], 'sales': ['Marine'],
+                             'date': [pd.Timestamp('2024-09-10')], 'mobile': ['0700000000']})
+
+    valid, rejected = prepare('farm;zip;mobile\n'
+                              'Kerhir;35000;\n'
+                              'Ferme du Moulin;35000;+33 7 00 00 00 00\n'
+                              'Ferme du Rocher;35000;\n', visitor_dedup.build_index(existing))
+
+    assert list(valid['farm']) == ['Ferme du Rocher']
+    assert list(rejected['motif']) == ['Déjà enregistré', 'Déjà enregistré']
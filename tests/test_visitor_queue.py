@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Submission queue: a failed job stays in the queue file and is retried.
+"""
+import time
+
+import visitor_queue
+import visitor_store
+
+
+def wait_for(condition, timeout=10):
+
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_failed_job_is_kept_and_retried(tmp_path, visitors, monkeypatch):
+
+    path = str(tmp_path / 'visitors.csv')
+    visitor_store.open_store(path).write_base(visitors.iloc[:10])
+
+    monkeypatch.setattr(visitor_queue, 'QUEUE_FILE', str(tmp_path / 'submissions.jsonl'))
+    monkeypatch.setattr(visitor_queue, 'RETRY_DELAY', 0.5)
+
+    # The first append fails, the next one goes through
+    append_visitor = visitor_store.append_visitor
+    calls = []
+
+    def flaky_append(db, data):
+        calls.append(data['farm'])
+        if len(calls) == 1:
+            raise OSError('disque plein')
+        append_visitor(db, data)
+
+    monkeypatch.setattr(visitor_store, 'append_visitor', flaky_append)
+
+    row = visitors.iloc[10].to_dict()
+    row['date'] = visitor_store.format_date(row['date'])
+    job_id = visitor_queue.submit(path, row)
+
+    wait_for(lambda: visitor_queue.status(job_id)['state'] != visitor_queue.PENDING)
+    assert visitor_queue.status(job_id)['state'] == visitor_queue.FAILED
+    assert [job['id'] for job in visitor_queue._pending_jobs()] == [job_id]
+
+    wait_for(lambda: visitor_queue.status(job_id)['state'] == visitor_queue.SAVED)
+    assert len(calls) == 2
+    assert visitor_queue._pending_jobs() == []
+    assert len(visitor_store.load_store(path)) == 11
+    assert row['farm'] in set(visitor_store.load_store(path)['farm'])
+
+    visitor_queue.forget(job_id)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Visitor statistics: counts built from a frame and kept up to date by appends.
+"""
+import threading
+
+import pandas as pd
+
+import visitor_stats
+import visitor_store
+
+
+def dataset(tmp_path, visitors, rows=40):
+
+    path = str(tmp_path / 'visitors.csv')
+    visitor_store.open_store(path).write_base(visitors.iloc[:rows])
+
+    return path
+
+
+def test_build_counts():
+
+    df = pd.DataFrame({'dept': ['35', '35', '29'], 'sales': ['Marine', 'Fabien', 'Marine'],
+                       'product': [['Nano', 'Moov'], ['Nano'], []],
+                       'date': pd.to_datetime(['2024-09-10 09:05', '2024-09-10 09:55', '2024-09-10 10:00'])})
+
+    counts = visitor_stats.build_counts(df)
+
+    assert counts['visitors']['all'] == 3
+    assert counts['dept'] == {'35': 2, '29': 1}
+    assert counts['product'] == {'Nano': 2, 'Moov': 1}
+    assert counts['date'] == {'2024-09-10 09:00': 2, '2024-09-10 10:00': 1}
+
+
+def test_counts_follow_appends_of_this_process(tmp_path, visitors):
+
+    path = dataset(tmp_path, visitors)
+    cached = visitor_stats.load_counts(path)
+
+    visitor_store.append_visitors(path, visitors.iloc[40:].to_dict('records'))
+
+    counts = visitor_stats.load_counts(path)
+
+    assert counts == visitor_stats.build_counts(visitor_store.read_store(path))
+    assert cached['visitors']['all'] == 40 # Counts already handed out are never changed
+
+
+def test_counts_follow_appends_of_other_writers(tmp_path, visitors):
+
+    path = dataset(tmp_path, visitors)
+    visitor_stats.load_counts(path)
+
+    # Written without the listeners of this process, as another process would
+    visitor_store.open_store(path).append(visitors.iloc[40:45].to_dict('records'))
+    visitor_store.append_visitors(path, visitors.iloc[45:].to_dict('records'))
+
+    assert visitor_stats.load_counts(path) == visitor_stats.build_counts(visitor_store.read_store(path))
+
+
+def test_merge_while_appending(tmp_path, visitors):
+
+    path = dataset(tmp_path, visitors)
+    visitor_stats.load_counts(path)
+    errors = []
+
+    def append():
+        for data in visitors.iloc[40:].to_dict('records') * 20:
+            visitor_store.append_visitor(path, data)
+
+    def merge():
+        try:
+            for _ in range(200):
+                visitor_stats.merge_counts([path])
+        except RuntimeError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=append), threading.Thread(target=merge)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert visitor_stats.merge_counts([path])['visitors']['all'] == 40 + 10 * 20
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Visitor store: journal appends, compaction, change feed and SQLite date
+migration, on every backend.
+"""
+import multiprocessing
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import visitor_store
+
+BACKENDS = ['csv', 'parquet', 'sqlite']
+
+
+def dataset(tmp_path, backend):
+
+    if backend == 'parquet' and visitor_store.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+
+    return str(tmp_path / f'visitors.{backend}')
+
+
+def records(df):
+
+    return df.to_dict('records')
+
+
+def append_from_process(path, rows):
+
+    visitor_store.append_visitors(path, rows)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_append_read_round_trip(tmp_path, visitors, backend):
+
+    path = dataset(tmp_path, backend)
+    visitor_store.create_store(path)
+
+    visitor_store.append_visitors(path, records(visitors.iloc[:30]))
+    visitor_store.append_visitor(path, records(visitors.iloc[30:31])[0])
+
+    df = visitor_store.read_store(path)
+
+    assert list(df.columns) == visitor_store.STORE_COLUMNS
+    assert list(df['farm']) == list(visitors['farm'].iloc[:31])
+    assert list(df['date']) == list(visitors['date'].iloc[:31])
+    assert list(df['product']) == list(visitors['product'].iloc[:31])
+    assert df['lat'].isna().sum() == visitors['lat'].iloc[:31].isna().sum()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_compaction_keeps_rows(tmp_path, visitors, backend):
+
+    path = dataset(tmp_path, backend)
+    store = visitor_store.open_store(path)
+    store.write_base(visitors.iloc[:40])
+    visitor_store.append_visitors(path, records(visitors.iloc[40:]))
+    before = visitor_store.read_store(path)
+
+    visitor_store.compact_store(path)
+
+    assert not os.path.isfile(store.journal)
+    # Parquet reads categoricals from the compacted file only: values are compared, not dtypes
+    pd.testing.assert_frame_equal(visitor_store.read_store(path), before, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_concurrent_appends_from_processes(tmp_path, visitors, backend):
+
+    # Each process appends under the file lock: no row is lost or interleaved
+    path = dataset(tmp_path, backend)
+    visitor_store.create_store(path)
+
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        pool.starmap(append_from_process, [(path, records(visitors.iloc[start:start + 10])) for start in range(0, 50, 10)])
+
+    assert sorted(visitor_store.read_store(path)['farm']) == sorted(visitors['farm'])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_changes_only_new_rows(tmp_path, visitors, backend):
+
+    path = dataset(tmp_path, backend)
+    store = visitor_store.open_store(path)
+    store.write_base(visitors.iloc[:40])
+    version = store.version()
+
+    assert len(store.changes(version)[1]) == 0
+
+    visitor_store.append_visitors(path, records(visitors.iloc[40:45]))
+    current, rows = visitor_store.changes_since(path, version)
+
+    assert current == store.version()
+    assert list(rows['farm']) == list(visitors['farm'].iloc[40:45])
+
+    visitor_store.append_visitors(path, records(visitors.iloc[45:]))
+
+    assert list(visitor_store.changes_since(path, current)[1]['farm']) == list(visitors['farm'].iloc[45:])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_changes_none_after_rewrite(tmp_path, visitors, backend):
+
+    path = dataset(tmp_path, backend)
+    store = visitor_store.open_store(path)
+    store.write_base(visitors)
+    version = store.version()
+
+    store.write_base(visitors.iloc[:10])
+
+    assert visitor_store.changes_since(path, version)[1] is None
+
+
+def test_cached_frame_follows_appends(tmp_path, visitors):
+
+    path = dataset(tmp_path, 'csv')
+    visitor_store.open_store(path).write_base(visitors.iloc[:40])
+    visitor_store.load_store(path)
+
+    visitor_store.append_visitors(path, records(visitors.iloc[40:]))
+
+    assert list(visitor_store.load_store(path)['farm']) == list(visitors['farm'])
+
+
+def test_sqlite_legacy_dates_migrated(tmp_path):
+
+    # Database written before dates were stored as ISO text
+    path = dataset(tmp_path, 'sqlite')
+    columns = ', '.join(f'{column} TEXT' for column in visitor_store.STORE_COLUMNS)
+    cnx = sqlite3.connect(path)
+    cnx.execute(f'CREATE TABLE visitors (id INTEGER PRIMARY KEY, {columns})')
+    cnx.execute('INSERT INTO visitors (date, farm, product) VALUES (?, ?, ?)', ('10/09/2024, 09:30:00', 'GAEC du Bois', '["Nano"]'))
+    cnx.commit()
+    cnx.close()
+
+    df = visitor_store.read_store(path)
+
+    assert df['date'].iloc[0] == pd.Timestamp('2024-09-10 09:30:00')
+    assert df['product'].iloc[0] == ['Nano']
+
+    cnx = sqlite3.connect(path)
+    assert cnx.execute('SELECT date FROM visitors').fetchone()[0] == visitor_store.format_date(pd.Timestamp('2024-09-10 09:30:00'))
+    cnx.close()
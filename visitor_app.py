@@ -3,32 +3,47 @@
 Created on 08/30/2024
 @author: Yann MARCOLINI
 """
+import time
+script_start = time.perf_counter()
 import pandas as pd
 import streamlit as st
 from streamlit_option_menu import option_menu
 from streamlit_cookies_controller import CookieController
 import hmac
-from geopy.geocoders import Nominatim
-import plotly.express as px
+import copy
 import datetime
+import functools
+import hashlib
+import importlib
 import json
-import urllib.request
 import os.path
 import math
-import webcolors
+import sys
+import visitor_store
+import visitor_geo
+import visitor_queue
+import visitor_dedup
+import visitor_metrics
+import visitor_tenants
+# plotly, webcolors, visitor_stats and visitor_import are loaded by lazy_import when their page is opened
 
 menu_options = ['Nouveau visiteur']
-menu_options_admin = ['Nouveau visiteur', 'Carte', 'Données', 'Téléchargements']
+menu_options_admin = ['Nouveau visiteur', 'Carte', 'Données', 'Téléchargements', 'Import', 'Performance']
 menu_icon = ['folder-symlink']
-menu_icon_admin = ['folder-symlink', 'map', 'activity', 'download']
-users_list = {"FullwoodJoz" : ['...', 'Fabien', 'Marine', 'Sébastien', 'Silvia', 'Sophie'], "Transfaire" : ["Transfaire"], "Admin" : ["Admin"]}
+menu_icon_admin = ['folder-symlink', 'map', 'activity', 'download', 'upload', 'speedometer2']
 prod_list = ['M²erlin', 'Barn-E', 'Nano', 'Moov', 'Racleur', 'Autre']
 eqt_list = ['TPA', 'Epi', 'Roto', 'Robot', 'Autre']
 brand_list = ['Boumatic', 'Delaval', 'Fullwood', 'Gascoigne-Melotte', 'GEA', 'Lely', 'Manus', 'Surge', 'Autre']
-user_db = {"FullwoodJoz" : "./data/fj_visitors.csv", "Transfaire" : "./data/trf_visitors.csv", "Admin" : "./data/fj_visitors.csv"}
-user_logo = {"FullwoodJoz" : "./img/fjm.png", "Transfaire" : "./img/transfaire.png", "Admin" : "./img/fjm.png"}
 terms_and_conditions_fj = "https://www.fullwoodjoz.com/fr/terms-and-conditions/"
-data_dir= './data/'
+zip_index_ttl = 24 * 3600 # Reload the postal code index once a day
+submission_poll = 2 # Seconds between two checks of the submission queue
+auto_refresh = 10 # Seconds between two refreshes of the admin pages when "Actualisation automatique" is on
+map_point_limit = 2000 # Above this number of markers the map switches to WebGL tiles
+map_cluster_limit = 20000 # Above this number of markers close points are clustered
+map_style = os.environ.get('VISITUS_MAP_STYLE', "white-bg") # No tile server needed (offline shows), VISITUS_MAP_STYLE=carto-positron adds the streets when online
+map_base_layer = './data/france.geojson' # Outline drawn under the WebGL map, white-bg has no tiles at all
+map_columns = ['farm', 'name', 'lat', 'lon'] # Columns kept in the map render cache
+profile_startup = os.environ.get('VISITUS_PROFILE') == '1' # Report import and first render timings
 empty_data = {
                             'date' : None,
                             'sales' : None,
@@ -62,12 +77,53 @@ lst_colors = ["aliceblue", "blueviolet", "cornflowerblue",
                
 st.set_page_config(layout="wide")
 
+@st.cache_resource
+def startup_timings():
+
+    # Timings of this process, kept across reruns (the script itself is executed again on every rerun)
+    return {}
+
+def record_timing(name, started):
+
+    # Keep the first measure of each step, printed for the container logs
+    if not profile_startup:
+        return
+
+    timings = startup_timings()
+
+    if name not in timings:
+        timings[name] = time.perf_counter() - started
+        print(f"[profile] {name}: {timings[name] * 1000:.0f} ms", file=sys.stderr)
+
+def lazy_import(name):
+
+    # Import a heavy module the first time a page needs it
+    module = sys.modules.get(name)
+
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        record_timing(f"import {name}", started)
+
+    return module
+
+def show_profile():
+
+    with st.sidebar.expander("Profil de démarrage", expanded=False):
+        for name, duration in startup_timings().items():
+            st.write(f"{name} : {duration * 1000:.0f} ms")
+
+record_timing("imports", script_start)
+
 def legend_layout(df, content, column, max_cols, colors, options_type):
 
     # Create a map legend layout showing selected items, number of occurences per item and associated color
 
     #with content.container(border=False):
 
+    # Occurences of every option in a single pass
+    counts = df[column].value_counts()
+
     layout_rows = math.ceil(len(options_type)/max_cols)
     
     for row in range(layout_rows):
@@ -86,18 +142,39 @@ def legend_layout(df, content, column, max_cols, colors, options_type):
             with columns[index+1]:
 
                 #Create color legend tile
-                legend = f" {option} ({str(len(df[df[column] == option]['name']))})"
-                st.color_picker(legend, webcolors.name_to_hex(colors[option]), key="color_picker_"+str(index)+str(row), disabled=False)
+                legend = f" {option} ({counts.get(option, 0)})"
+                st.color_picker(legend, lazy_import('webcolors').name_to_hex(colors[option]), key="color_picker_"+str(index)+str(row), disabled=False)
                         
-def color_picker(df, column, content):
+def select_period(paths, content):
+
+    # Date range picker bounded by the first and last visits, returns (start, end) with end excluded
+    first, last = visitor_store.date_bounds(paths)
+
+    if first is None:
+        return None
+
+    period = content.date_input("Période", value=(first.date(), last.date()), min_value=first.date(), max_value=last.date(), format="DD/MM/YYYY")
+
+    if len(period) != 2 or (period[0] == first.date() and period[1] == last.date()):
+        # Whole history (or range still being picked): no filter
+        return None
+
+    return pd.Timestamp(period[0]), pd.Timestamp(period[1]) + pd.Timedelta(days=1)
+
+def select_options(paths, column, content):
+
+    # Values of the category over the selected datasets, read from the store without loading rows
+    options = visitor_store.distinct_values(paths, column)
+
+    return content.multiselect("Pick up one or more categories", options, options, key="cat")
+
+def color_picker(df, column, content, options_type):
 
     # Assign a color to each selected column item
 
-    options_type = content.multiselect("Pick up one or more categories", list(df[column].unique()), list(df[column].unique()), key="cat")
     colors={}
 
     if options_type != None:
-        df = df[df[column].isin(options_type)]
 
         with content.expander("Réglages couleurs", expanded=False, icon=":material/waving_hand:"):
 
@@ -109,22 +186,108 @@ def color_picker(df, column, content):
             if len(colors) != 0:  
 
                 # Create a legend layout showing markers color
-                legend_layout(df, content, column, len(list(df[column].unique())), colors, options_type)
+                legend_layout(df, content, column, df[column].nunique(), colors, options_type)
                 
-            # Assign color index to markers and create a new column in dataset
-            df['color']= df[column].apply(lambda x: colors[x])
+            # Assign color index to markers and create a new column in dataset (the cached rows are left untouched)
+            df = df.assign(color=df[column].map(colors))
     
         return df
 
+def render_cache(name, key, build, versions=None, update=None):
+
+    # Per-session cache of a page section, rebuilt only when its inputs (datasets version, selections) change
+    cache = st.session_state.setdefault("render_cache", {})
+
+    if versions is None:
+
+        hit = name in cache and cache[name][0] == key
+        visitor_metrics.cache(f"render_{name}", hit)
+
+        if not hit:
+            cache[name] = (key, None, build())
+
+        return cache[name][2]
+
+    # Versioned sections: build() and update(versions, value) return (versions read, value),
+    # update() only reads the rows appended since and returns None when everything must be read again
+    cached = cache.get(name)
+    hit = cached is not None and cached[0] == key and cached[1] == versions
+    visitor_metrics.cache(f"render_{name}", hit)
+
+    if not hit:
+
+        result = None
+
+        if update is not None and cached is not None and cached[0] == key:
+            result = update(cached[1], cached[2])
+
+        if result is None:
+            result = build()
+
+        cache[name] = (key,) + tuple(result)
+
+    return cache[name][2]
+
+def store_versions(paths):
+
+    return tuple(visitor_store.store_version(path) for path in paths)
+
+def map_rows(df, feature, options_type):
+
+    # The session only keeps what the map draws, coordinates in float32
+    df = df[list(dict.fromkeys(map_columns + [feature]))].astype({'lat': 'float32', 'lon': 'float32'})
+
+    if feature == 'product':
+        # One marker per (visitor, product) since a visitor can be interested in several products
+        df = df.explode('product')
+        df = df[df['product'].isin(options_type)]
+
+    return df
+
+def map_frame(paths, feature, options_type, period, dedup):
+
+    # Only the visitors of the selected options and period are loaded (SQL WHERE for SQLite datasets)
+    versions, df = visitor_store.versioned_query(paths, {feature: options_type}, period)
+
+    if dedup:
+        df = visitor_dedup.deduplicate(df)
+
+    return versions, map_rows(df, feature, options_type)
+
+def map_update(paths, feature, options_type, period, dedup, versions, df):
+
+    # Markers of the visitors recorded since `versions` added to the cached ones
+    if dedup:
+        # A new visitor can merge with one already drawn
+        return None
+
+    versions, rows = visitor_store.changes_since_many(paths, versions)
+
+    if rows is None:
+        return None
+
+    rows = visitor_store.filter_rows(rows, {feature: options_type}, period)
+
+    if len(rows) == 0:
+        return versions, df
+
+    return versions, pd.concat([df, map_rows(rows, feature, options_type)])
+
 def add_header_content(header_id, logo, title):
 
     header_id.image(logo)
     header_id.subheader(title)
      
+@st.cache_resource(ttl=zip_index_ttl)
+def get_zip_index():
+
+    # Postal code index shared by every session, loaded once per process
+    return visitor_geo.load_zip_index()
+
+@visitor_metrics.timed('search_city')
 def search_city(zip):
 
     noms_ville = []
-    api_base = 'https://geo.api.gouv.fr/communes?codePostal='
 	
     if len(zip) != 5:
 
@@ -132,20 +295,16 @@ def search_city(zip):
     
     else:
     
-        cnx = urllib.request.urlopen(api_base + zip)
-        contenu = cnx.read().decode('utf8')
-        json_lisible = json.loads(contenu)
-
-        for info in json_lisible:
-            noms_ville.append(info['nom'])
-        return noms_ville
+        noms_ville = visitor_geo.lookup_zip(get_zip_index(), zip)
+        
+    return noms_ville
 
 def check_password(controller):
     
     def login_form():
         
         with st.form("Credentials"):
-            st.selectbox("Utilisateur", ["FullwoodJoz", "Transfaire", "Admin"], key="username")
+            st.selectbox("Utilisateur", visitor_tenants.accounts(), key="username")
             st.text_input("Mot de passe", type="password", key="password")
             st.form_submit_button("Valider", on_click=password_entered)
         
@@ -178,24 +337,118 @@ def check_password(controller):
         st.error("😕 User not known or password incorrect")
     return False
 
+@visitor_metrics.timed('add_visitor')
 def add_visitor(file, data, container):
     
-    if os.path.isfile(file):
-        df = pd.read_csv(file, sep=";")
-        df = pd.concat([df, pd.DataFrame([data])], ignore_index=True)
-        container.dataframe(pd.DataFrame([data]))
-        df.to_csv(file, sep=";", index=False)
-   
-    container.info(f"Informations concernant {data['farm']} dans le dept. {data['dept']} bien enregistrées dans {file} le {data['date'].split(',')[0]} à {data['date'].split(',')[1]}.", icon="ℹ️")
+    # Hand the visitor over to the background queue (geocoding + storage) and return at once
+    job_id = visitor_queue.submit(file, data)
+    st.session_state.setdefault("submissions", []).append(job_id)
+    container.dataframe(pd.DataFrame([data]))
+
+    container.info(f"Enregistrement de {data['farm']} en cours...", icon="⏳")
+
+@st.fragment(run_every=submission_poll)
+def show_submissions():
+
+    # Report the outcome of the visitors submitted from this session, polled without rerunning the page
+    messages = st.session_state.setdefault("submission_messages", [])
+
+    for job_id in list(st.session_state.get("submissions", [])):
+
+        job = visitor_queue.status(job_id)
+
+        if job is None or job['state'] == visitor_queue.PENDING:
+            continue
+
+        file, data = job['db'], job['data']
+
+        if job['state'] == visitor_queue.SAVED and job['message'] is not None:
+            messages.append(("warning", f"{data['farm']} : {job['message']}"))
+        elif job['state'] == visitor_queue.SAVED:
+            date = visitor_store.parse_date(data['date'])
+            messages.append(("info", f"Informations concernant {data['farm']} dans le dept. {data['dept']} bien enregistrées dans {file} le {date:%d/%m/%Y} à {date:%H:%M:%S}."))
+        else:
+            messages.append(("warning", f"{data['farm']} n'a pas été enregistré : {job['message']}"))
+
+        visitor_queue.forget(job_id)
+        st.session_state["submissions"].remove(job_id)
+
+    # Keep the last outcomes on screen
+    del messages[:-5]
+
+    for level, message in messages:
+        if level == "info":
+            st.info(message, icon="ℹ️")
+        else:
+            st.warning(message, icon="⚠️")
+
+@st.cache_resource
+def map_layers():
+
+    # Offline outline of France, no layer when the file is missing
+    if not os.path.exists(map_base_layer):
+        return []
+
+    with open(map_base_layer, encoding='utf-8') as f:
+        geojson = json.load(f)
+
+    return [dict(source=geojson, type='fill', color='whitesmoke', below='traces'),
+            dict(source=geojson, type='line', color='darkgray', line=dict(width=1), below='traces')]
+
+def map_figure_gl(df):
+
+    # WebGL tile map for large datasets, markers are clustered above map_cluster_limit
 
-def geocode_adr(adr, country='France'):
-   
-    geolocator = Nominatim(user_agent="visitus")
-    location = geolocator.geocode(f'{adr}, {country}')
+    fig = lazy_import('plotly.express').scatter_map(
+                    df,
+                    lon='lon',
+                    lat='lat',
+                    hover_data= {"farm":True, "name":True, "lat":False, "lon":False},
+                    map_style=map_style,
+                    center=dict(lat=df['lat'].mean(), lon=df['lon'].mean()),
+                    zoom=4.5,
+                )
 
-    return location.latitude, location.longitude
+    fig.update_traces(marker=dict(size=8,
+                    ),
+                    opacity=0.8,
+                    cluster=dict(enabled=len(df) > map_cluster_limit),
+                )
+
+    fig.update_layout(
+                    margin={'r':0, 't':0, 'b':0, 'l':0},
+                    hoverlabel=dict(bgcolor="#fff", bordercolor="#fff", font_color="#333", font_size=12, font_family="MS Sans Serif"),
+                    map_layers=map_layers(),
+                        )
 
-def show_map(df, container):
+    return fig
+
+def plot_chart(container, fig, name, **kwargs):
+
+    # Plotly serialization is the largest payload sent to the browser, its size is only measured when instrumented
+    if visitor_metrics.ENABLED:
+        visitor_metrics.payload(name, len(fig.to_json()))
+
+    with visitor_metrics.timer(name):
+        container.plotly_chart(fig, **kwargs)
+
+def show_map(df, container, key=None):
+
+    # The figure is built once per selection of rows, a color change only repaints the markers
+    if key is None:
+        fig = map_figure(df)
+    else:
+        fig = render_cache("map_figure", key, lambda: map_figure(df))
+
+    fig.update_traces(marker=dict(color=df['color']))
+
+    plot_chart(container, fig, "plotly_map", use_container_width=True)
+
+def map_figure(df):
+
+    # SVG markers do not scale past a few thousand points
+    if len(df) > map_point_limit:
+        return map_figure_gl(df)
 
     # create the maps
 
@@ -210,7 +463,7 @@ def show_map(df, container):
         country_color = "darkgray"
         ocean_color="LightBlue"
 
-    fig = px.scatter_geo(
+    fig = lazy_import('plotly.express').scatter_geo(
                     df,
                     lon='lon',
                     lat='lat',
@@ -236,7 +489,6 @@ def show_map(df, container):
     
     fig.update_traces(marker=dict(size=8,
                     symbol="circle",
-                    color=df['color'],
                     line=dict(width=2,
                     color='lightskyblue',
                     )),
@@ -270,37 +522,50 @@ def show_map(df, container):
                             ),
                         )
     
-    container.plotly_chart(fig, use_container_width=True)
+    return fig
 
 def show_data(df, container, criteria):
 
     container.dataframe(df.sort_values(by=criteria, ascending=True))
 
-def pie_graph(df, fig, wrapper, values, names, title, hole=.5):
-        fig = px.pie(df, values=values, names=names, hole=hole, title=title)
+def pie_graph(df, values, names, title, hole=.5):
+        fig = lazy_import('plotly.express').pie(df, values=values, names=names, hole=hole, title=title)
         fig.update_traces(textposition='inside', textinfo='percent+label')
-        wrapper.plotly_chart(fig)
+        return fig
+
+def hist_graph(df, x, color, title, y=None):
+        fig = lazy_import('plotly.express').histogram(df, x=x, y=y, color=color, title=title)
+        return fig
+
+def analytics_figures(counts):
 
-def hist_graph(df, fig, wrapper, x, color, title, use_container_width=True):
-        fig = px.histogram(df, x=x, color=color, title=title)
-        wrapper.plotly_chart(fig, use_container_width=use_container_width)
+        # The four charts of the page, kept in the render cache until the counts change
+        visitor_stats = lazy_import('visitor_stats')
 
-def show_analytics(df, container):
+        fig_pg1 = pie_graph(visitor_stats.count_frame(counts, "dept"), "count", "dept", "Visiteurs par département")
+        fig_pg2 = hist_graph(visitor_stats.count_frame(counts, "product"), "product", "product", "Types de projet", y="count")
+        fig_hist1 = hist_graph(visitor_stats.count_frame(counts, "sales"), "sales", "sales", "Visiteurs par SAM", y="count")
+        fig_hist2 = hist_graph(visitor_stats.count_frame(counts, "date"), "date", None, "Visiteurs par date & heure", y="count")
+
+        return fig_pg1, fig_pg2, fig_hist1, fig_hist2
+
+def show_analytics(counts, figures, container):
         
+        # Charts are drawn from the per-value counts of visitor_stats, not from the visitors
         col1, col2, col3 = container.columns(3)
         
-        visitor_count = df.shape[0]
+        visitor_count = counts['visitors']['all']
 
         with col1:
             with st.container(border=True):
                 st.metric(label="Visiteurs", value=visitor_count, delta=None, help=None, label_visibility="visible")
 
-        dept_count = df['dept'].nunique()
+        dept_count = len(counts['dept'])
         with col2:
             with st.container(border=True):
                 st.metric(label="Départements", value=dept_count, delta=None, help=None, label_visibility="visible")
 
-        dept_sales = df['sales'].nunique()
+        dept_sales = len(counts['sales'])
         with col3:
             with st.container(border=True):
                 st.metric(label="Donateurs", value=dept_sales, delta=None, help=None, label_visibility="visible")
@@ -310,35 +575,136 @@ def show_analytics(df, container):
             col_pg1, col_pg2 = st.columns(2)
             col_hist1, col_hist2 = st.columns(2)
 
-            fig_pg1, fig_pg2 = None, None
+            fig_pg1, fig_pg2, fig_hist1, fig_hist2 = figures
     
-            pie_graph(df, fig_pg1, col_pg1, "dept", "dept", "Visiteurs par département")
+            plot_chart(col_pg1, fig_pg1, "plotly_analytics")
 
-            hist_graph(df, fig_pg2, col_pg2, "product", "product", "Types de projet")
-            
-            fig_hist1, fig_hist2 = None, None
+            plot_chart(col_pg2, fig_pg2, "plotly_analytics", use_container_width=True)
+
+            plot_chart(col_hist1, fig_hist1, "plotly_analytics", use_container_width=True)
+
+            plot_chart(col_hist2, fig_hist2, "plotly_analytics", use_container_width=True)
+
+def warn_duplicates(db, farm, mobile, zip, container):
+
+    # Tell the SAM when this farm looks already recorded (by anyone, at the shows running now)
+    if farm == '' and mobile == '':
+        return
+
+    # Past events are left out: their datasets are not parsed while a SAM types
+    catalog = {partition['path']: partition for partition in visitor_tenants.partitions(events=visitor_tenants.current_events())}
+
+    for path, matches in visitor_dedup.find_duplicates(list(catalog), farm, mobile, zip).items():
+
+        if os.path.normpath(path) == os.path.normpath(db):
+            for match in matches[:3]:
+                date = visitor_store.parse_date(match['date'])
+                when = f" le {date:%d/%m/%Y}" if date is not None else ""
+                container.warning(f"{match['farm']} ({match['zip']}) déjà enregistré par {match['sales']}{when}.", icon="⚠️")
+        else:
+            # Other resellers' visitors are not shown
+            container.warning(f"Cet élevage semble déjà enregistré par {visitor_tenants.tenant_name(catalog[path]['tenant'])}.", icon="⚠️")
+
+def show_export(container):
+
+    # Filtered or merged export, the file is only built when the button is clicked
+    if not container.toggle("Export filtré"):
+        return
+
+    with container.container(border=True):
+
+        wrapper = st.container(border=False)
+        paths = select_paths(wrapper)
+
+        if len(paths) == 0:
+            return
+
+        sams = wrapper.multiselect("SAM", visitor_store.distinct_values(paths, 'sales'))
+        depts = wrapper.multiselect("Départements", visitor_store.distinct_values(paths, 'dept'))
+        period = select_period(paths, wrapper)
+        export_format = wrapper.selectbox("Format", list(visitor_store.EXPORT_FORMATS))
+
+        filters = {}
+        if len(sams) != 0:
+            filters['sales'] = sams
+        if len(depts) != 0:
+            filters['dept'] = depts
+
+        wrapper.download_button('Exporter',
+                                functools.partial(visitor_store.open_export, paths, export_format, filters, period),
+                                file_name='visiteurs' + visitor_store.EXPORT_FORMATS[export_format],
+                                mime='text/csv' if export_format == 'CSV' else 'application/octet-stream',
+                                key='export')
+
+def show_import(container):
+
+    # Bulk import of a visitor list: validated, deduplicated and written in one append
+    partitions = visitor_tenants.partitions()
+
+    if len(partitions) == 0:
+        container.info("😕 Pas de données disponible.")
+        return
+
+    target = container.selectbox("Données", partitions, index=0, format_func=visitor_tenants.label)['path']
+    sams = sorted({sam for tenant in visitor_tenants.load_registry()['tenants'].values() for sam in tenant['sams'] if sam != "..."})
+    sam = container.selectbox("SAM (si la colonne 'sales' est vide)", sams)
+    upload = container.file_uploader("Liste de visiteurs (CSV ou Excel, colonnes comme l'export CSV)", type=['csv', 'xlsx'])
+
+    if upload is None:
+        return
+
+    def validate():
+        df_upload = lazy_import('visitor_import').read_upload(upload.getvalue(), upload.name)
+        return lazy_import('visitor_import').prepare_import(df_upload, visitor_dedup.load_index(target), get_zip_index(),
+                                                            eqt_list, brand_list, prod_list, sales=sam)
 
-            hist_graph(df, fig_hist1, col_hist1, "sales", "sales", "Visiteurs par SAM")
+    # Validated (and cities looked up) once per file, target version and SAM: "Importer" writes these rows
+    import_key = (hashlib.sha256(upload.getvalue()).hexdigest(), upload.name, target, visitor_store.store_version(target), sam)
 
-            hist_graph(df, fig_hist2, col_hist2, "date", None, "Visiteurs par date & heure")
+    try:
+        valid, rejected = render_cache("import", import_key, validate)
+    except (ValueError, ImportError) as error:
+        container.warning(f"Fichier illisible : {error}", icon="⚠️")
+        return
 
-def listdir(path):
+    container.write(f"{len(valid)} visiteurs à importer, {len(rejected)} lignes écartées.")
 
-    list_file = []
+    if len(rejected) != 0:
+        with container.expander("Lignes écartées", expanded=False):
+            st.dataframe(rejected)
 
-    for f in os.listdir(path):
+    if len(valid) != 0:
 
-        if len(f) > 5:
-            list_file.append(f)
+        container.dataframe(valid)
 
+        if container.button('Importer'):
+            imported = lazy_import('visitor_import').import_visitors(target, valid)
+            container.info(f"{imported} visiteurs enregistrés dans {target}.", icon="ℹ️")
 
-    return list_file
+def show_performance(container):
 
-def make_filepath(dir, file):
+    # Measures of this process since it started (or since the last reset)
+    if not visitor_metrics.ENABLED:
+        container.info("😕 Instrumentation désactivée : démarrer l'application avec VISITUS_METRICS=1.")
+        return
 
-    filepath = dir + file
+    latency, payloads, caches = visitor_metrics.snapshot()
 
-    return filepath
+    container.write("**Latences (ms)**")
+    container.dataframe(pd.DataFrame(latency), hide_index=True)
+
+    container.write("**Volumes (ko)**")
+    container.dataframe(pd.DataFrame(payloads), hide_index=True)
+
+    container.write("**Caches**")
+    container.dataframe(pd.DataFrame(caches), hide_index=True)
+
+    columns = container.columns(2)
+    columns[0].download_button('Télécharger (Prometheus)', visitor_metrics.prometheus_text(),
+                               file_name='metrics.prom', mime='text/plain')
+
+    if columns[1].button('Remettre à zéro'):
+        visitor_metrics.reset()
 
 def check_df_status(df, container):
 
@@ -360,41 +726,200 @@ def check_df_status(df, container):
     
     return result
 
-def select_dataset(data_dir, content, instr_all="Fusionner"):
+def select_paths(content, instr_all="Fusionner"):
 
-    # search datasets in directory and put them in a selectbox
-    datasets = listdir(data_dir)
+    # Pick an event then one of its partitions (or all of them) in the catalog, other events are never read
+    events = visitor_tenants.events()
 
-    df_ = None
+    paths = []
 
-    if len(datasets) !=0:
+    if len(events) !=0:
 
+        event = content.selectbox("Evénement", events, index=len(events) - 1)
+        partitions = visitor_tenants.partitions(events=[event])
+
+        datasets = [visitor_tenants.label(partition) for partition in partitions]
         datasets.append(instr_all)
         selected_data = content.selectbox("Données", datasets, index=0)
-        master_dataset = make_filepath(data_dir, selected_data)          
 
         if selected_data == instr_all:
+            paths = [partition['path'] for partition in partitions]
+        else:
+            paths = [partitions[datasets.index(selected_data)]['path']]
 
-            if len(datasets[:-1]) > 1:
-
-                empty = pd.DataFrame([empty_data])
+    return paths
 
-                for dataset in datasets[:-1]:
+@st.fragment
+def visitor_form(db, user_cookie):
 
-                    new = pd.read_csv(make_filepath(data_dir, dataset), sep=";")
+    # Typing in the form only reruns the form, not the cookies and the menu
+    content = st.container(border=False)
 
-                    if df_ is None:
-                        df_ = pd.concat([empty, new], ignore_index=True)
-                    else:
-                        df_ = pd.concat([df_, new], ignore_index=True)
-            
-            else:
-                df_ = pd.read_csv(master_dataset, sep=";")
-                    
+    sam = content.selectbox("SAM", visitor_tenants.account(user_cookie)['sams'])
+
+    if sam != "...":
+
+        now = datetime.datetime.now()
+        col_date, col_time = content.columns(2)
+        visit_day = col_date.date_input('date', value = now.date(), format="DD/MM/YYYY")
+        visit_time = col_time.time_input('heure', value = now.time(), step = 60)
+        date_now = visitor_store.format_date(datetime.datetime.combine(visit_day, visit_time))
+        farm = content.text_input('Elevage')
+        name = content.text_input('Nom')
+        address = content.text_input('Adresse')
+        zip = content.text_input('Code postal')
+        dept = zip[:2] # Extract dept. number from zip code
+        liste_ville = search_city(zip) # Search city name out of zipcode
+        if len(liste_ville) != 0:
+            city = content.selectbox("Ville", liste_ville)
+        else:
+            # Postal code unknown or API unreachable
+            city = content.text_input("Ville")
+        mobile = content.text_input('Mobile')
+        warn_duplicates(db, farm, mobile, zip, content)
+        cows = content.text_input('Nb vaches laitières')
+        milking_eqt = content.selectbox("Equipement actuel", eqt_list)
+        brand = content.selectbox("Marque actuelle", brand_list)
+        product = content.multiselect("Intéressé par", prod_list)
+
+        content.write("Règles sur le traitement de vos données à lire [ici](%s) " % terms_and_conditions_fj)
+        gdpr_agreed = content.checkbox("J'ai lu les conditions et j'accepte le traitement de mes données par FullwoodJoz.", value=True)
+
+        if gdpr_agreed:
+
+            submit = content.button('Valider')
+
+            if submit:                
+
+                # Coordinates are resolved by the submission queue
+                data_dict = {
+                    'date' : date_now,
+                    'sales' : sam,
+                    'farm': farm,
+                    'name': name,
+                    'address': address,
+                    'zip': zip,
+                    'dept': dept,
+                    'city': city,
+                    'mobile': mobile,
+                    'cows': cows,
+                    'eqt': milking_eqt,
+                    'brand': brand,
+                    'product': product,
+                    'lat':None,
+                    'lon':None,
+                    }
+
+                add_visitor(db, data_dict, content)       
         else:
-            df_ = pd.read_csv(master_dataset, sep=";")
 
-    return df_
+            content.warning('Vous devez accepter les conditions sur la vie privée.', icon="⚠️")
+
+def refresh_every():
+
+    # Admin pages poll the datasets when "Actualisation automatique" is on
+    return auto_refresh if st.session_state.get("auto_refresh") else None
+
+@st.fragment(run_every=refresh_every())
+def map_page():
+
+    # Picking a color only reruns the map section, rows and figure come from the render cache
+    content = st.container(border=False)
+
+    # Search datasets in a directory and create a selectbox of datasets
+    map_paths = select_paths(content)
+
+    if len(map_paths) != 0:
+        map_options = ['sales', 'dept', 'eqt', 'product']
+        feature = content.selectbox("Pick up one category", map_options, index=0)
+        options_type = select_options(map_paths, feature, content)
+        period = select_period(map_paths, content)
+        dedup = content.checkbox("Fusionner les doublons", key="dedup_map")
+
+        # Rows are only queried again when a dataset or a selection changed, not when a color did
+        # and only the new visitors are read when a dataset grew
+        map_key = (tuple(map_paths), feature, tuple(options_type), period, dedup)
+        df_map = render_cache("map_frame", map_key, lambda: map_frame(map_paths, feature, options_type, period, dedup),
+                              store_versions(map_paths),
+                              lambda versions, df: map_update(map_paths, feature, options_type, period, dedup, versions, df))
+    else:
+        df_map = None
+
+    # Check that dataset is not None and not empty
+    map_check = check_df_status(df_map, content)
+
+    if map_check == True:
+        df_map = color_picker(df_map, feature, content, options_type)
+        # Same rows as the cached frame: same selection and same dataset versions (an update can keep the row count)
+        show_map(df_map, content, (map_key, st.session_state["render_cache"]["map_frame"][1]))
+
+def stats_figures(counts):
+
+    if counts['visitors']['all'] == 0:
+        return counts, None
+
+    return counts, analytics_figures(counts)
+
+def stats_render(paths, period, dedup):
+
+    visitor_stats = lazy_import('visitor_stats')
+
+    if period is None and not dedup:
+        # Counts kept up to date by visitor_stats, new visitors included
+        versions = store_versions(paths)
+        return versions, stats_figures(visitor_stats.merge_counts(paths))
+
+    versions, df = visitor_store.versioned_query(paths, date_range=period)
+
+    if dedup:
+        # Each farm counted once, whoever recorded it
+        df = visitor_dedup.deduplicate(df)
+
+    # Counts of a single show are computed from its visitors only
+    return versions, stats_figures(visitor_stats.build_counts(df))
+
+def stats_update(paths, period, dedup, versions, rendered):
+
+    # Counts of the visitors recorded since `versions` added to the cached ones, charts drawn again
+    if period is None or dedup:
+        return None
+
+    versions, rows = visitor_store.changes_since_many(paths, versions)
+
+    if rows is None:
+        return None
+
+    counts = copy.deepcopy(rendered[0])
+    lazy_import('visitor_stats').add_counts(counts, visitor_store.filter_rows(rows, date_range=period))
+
+    return versions, stats_figures(counts)
+
+@st.fragment(run_every=refresh_every())
+def stats_page():
+
+    content = st.container(border=False)
+
+    # Search datasets in a directory, create a selectbox of datasets and return their counts
+    stats_paths = select_paths(content)
+
+    counts = None
+
+    if len(stats_paths) != 0:
+
+        period = select_period(stats_paths, content)
+        dedup = content.checkbox("Fusionner les doublons", key="dedup_stats")
+
+        # Counts and charts are only rebuilt when a dataset or a selection changed
+        stats_key = (tuple(stats_paths), period, dedup)
+        counts, figures = render_cache("analytics", stats_key, lambda: stats_render(stats_paths, period, dedup),
+                                       store_versions(stats_paths),
+                                       lambda versions, rendered: stats_update(stats_paths, period, dedup, versions, rendered))
+
+    # Check that there is at least one visitor
+    if counts is not None and counts['visitors']['all'] != 0:
+        show_analytics(counts, figures, content)
+    else:
+        content.info("😕 Pas de données disponible.")
 
 def main():
         
@@ -403,16 +928,18 @@ def main():
 
     # Check security access
     if not check_password(controller):
+        record_timing("login form", script_start)
         st.stop()
     
     # Welcome text
     #st.write(f'{user_cookie}')
 
-    # Create logo and user dataset according to the user
+    # Create logo and user dataset according to the user (tenant registry)
     if user_cookie is not None:
 
-        logo = user_logo[user_cookie]
-        db = user_db[user_cookie]
+        account = visitor_tenants.account(user_cookie)
+        logo = account['logo']
+        db = visitor_tenants.write_partition(user_cookie)
 
     # App lay-out
     
@@ -429,12 +956,16 @@ def main():
     # Menu sidebar
     with st.sidebar:
 
-        if user_cookie == "Admin":
+        if account['admin']:
 
             sb_menu = option_menu('Menu', 
                                             menu_options_admin, 
                                             icons=menu_icon_admin, 
                                             menu_icon='cast', default_index=0, orientation="vertical")
+
+            # Map and statistics poll the datasets and only read the visitors recorded since
+            st.toggle("Actualisation automatique", key="auto_refresh",
+                      help=f"Carte et données mises à jour toutes les {auto_refresh} s")
         else:
 
             sb_menu = option_menu('Menu', 
@@ -447,99 +978,29 @@ def main():
     
         add_header_content(header, logo, 'Nouveau visiteur')
 
-        sam = content.selectbox("SAM", users_list[user_cookie])
-
-        if sam != "...":
-
-            now = datetime.datetime.now()
-            date_now = content.text_input('date', value = now.strftime("%d/%m/%Y, %H:%M:%S"))
-            farm = content.text_input('Elevage')
-            name = content.text_input('Nom')
-            address = content.text_input('Adresse')
-            zip = content.text_input('Code postal')
-            dept = zip[:2] # Extract dept. number from zip code
-            liste_ville = search_city(zip) # Search city name out of zipcode
-            city = content.selectbox("Ville", liste_ville)
-            mobile = content.text_input('Mobile')
-            cows = content.text_input('Nb vaches laitières')
-            milking_eqt = content.selectbox("Equipement actuel", eqt_list)
-            brand = content.selectbox("Marque actuelle", brand_list)
-            product = content.multiselect("Intéressé par", prod_list)
-
-            content.write("Règles sur le traitement de vos données à lire [ici](%s) " % terms_and_conditions_fj)
-            gdpr_agreed = content.checkbox("J'ai lu les conditions et j'accepte le traitement de mes données par FullwoodJoz.", value=True)
+        # Outcome of the previous submissions (geocoding and storage run in background)
+        with content:
+            show_submissions()
 
-            if gdpr_agreed:
+        with content:
+            visitor_form(db, user_cookie)
 
-                submit = content.button('Valider')
-            
-                if submit:                
-    
-                    if address is not None:
-                        adr = f'{address}, {zip}, {city}'
-                    else:
-                        adr = f'{zip}, {city}'
-    
-                    lat, lon = geocode_adr(adr)
-    
-                    if (lat!=None) and (lon!=None):
-    
-                        data_dict = {
-                            'date' : date_now,
-                            'sales' : sam,
-                            'farm': farm,
-                            'name': name,
-                            'address': address,
-                            'zip': zip,
-                            'dept': dept,
-                            'city': city,
-                            'mobile': mobile,
-                            'cows': cows,
-                            'eqt': milking_eqt,
-                            'brand': brand,
-                            'product': product,
-                            'lat':lat,
-                            'lon':lon,
-                            }
-                        
-                        add_visitor(db, data_dict, content)       
-            else:
-
-                content.warning('Vous devez accepter les conditions sur la vie privée.', icon="⚠️")             
-
-    if user_cookie == "Admin":
+    if account['admin']:
 
         if sb_menu == menu_options_admin[1]:
 
             add_header_content(header, logo, 'Geomapping visiteurs')
 
-            # Search datasets in a directory, create a selectbox of datasets and return a single dataset 
-            df_map = select_dataset(data_dir, content)
-
-            # Check that dataset is not None and not empty
-            map_check = check_df_status(df_map, content)
-            
-            if map_check == True:
-                map_options = ['sales', 'dept', 'eqt', 'product']
-                feature = content.selectbox("Pick up one category", map_options, index=0)
-                df_map = color_picker(df_map, feature, content)
-                show_map(df_map, content)              
-
+            with content:
+                map_page()
 
         if sb_menu == menu_options_admin[2]:
 
             add_header_content(header, logo, 'Statistiques visiteurs')
 
-            # Search datasets in a directory, create a selectbox of datasets and return a single dataset
-            df_analytics = select_dataset(data_dir, content)
+            with content:
+                stats_page()
 
-            # Check that dataset is not None and not empty
-            data_check = check_df_status(df_analytics, content)
-            
-            if data_check == True:
-                show_analytics(df_analytics, content)
-            
-        
         if sb_menu == menu_options_admin[3]:
 
             add_header_content(header, logo, 'Téléchargements')
@@ -548,18 +1009,40 @@ def main():
 
             with content.container(border=False):
 
-                for f in os.listdir(data_dir):
+                for partition in visitor_tenants.partitions():
+
+                    link = partition['path']
+                    columns = st.columns(2)
+
+                    columns[0].write(f"{visitor_tenants.label(partition)} ({link})")
+
+                    # The CSV is only produced when the button is clicked
+                    columns[1].download_button('Télécharger le fichier CSV',
+                                               functools.partial(visitor_store.open_export, [link]),
+                                               file_name=visitor_tenants.slug(visitor_tenants.label(partition)) + '.csv',
+                                               mime='text/csv',
+                                               key=key_index)
+                    key_index += 1
+
+            show_export(content)
+
+        if sb_menu == menu_options_admin[4]:
+
+            add_header_content(header, logo, 'Import de visiteurs')
+
+            show_import(content)
+
+        if sb_menu == menu_options_admin[5]:
 
-                    if len(f) > 5:
+            add_header_content(header, logo, 'Performance')
 
-                        link = make_filepath(data_dir, f)
-                        columns = st.columns(2)
+            show_performance(content)
 
-                        columns[0].write(link)
+    # First render of each page, lazy imports included
+    record_timing(f"first render {sb_menu}", script_start)
 
-                        with open(link) as f:
-                            columns[1].download_button('Télécharger le fichier CSV', f, key=key_index)
-                            key_index += 1
+    if profile_startup:
+        show_profile()
 
     
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Benchmarks of the non-UI logic on synthetic visitor datasets.
+
+    python visitor_bench.py                          # 10k and 100k rows, CSV
+    python visitor_bench.py --rows 10000,1000000,5000000 --backends csv,parquet,sqlite
+    python visitor_bench.py --save                   # record the current timings as the baseline
+
+Datasets have the columns of the form (visitor_store.STORE_COLUMNS) and
+are written in a temporary directory. Geocoding and the postal code API are
+stubbed, nothing leaves the machine. Every step is run REPEAT times and the
+fastest run is kept; steps slower than REGRESSION_RATIO times the baseline
+are reported and make the command exit with 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import visitor_dedup
+import visitor_geo
+import visitor_queue
+import visitor_stats
+import visitor_store
+
+BASELINE_FILE = './visitor_bench.json'
+DEFAULT_ROWS = [10000, 100000]
+REPEAT = 3
+APPEND_CALLS = 200 # Visitors submitted one by one in the add_visitor step
+REGRESSION_RATIO = 1.25
+NOISE_FLOOR = 0.005 # Seconds, smaller slowdowns are timer noise
+SEED = 2024
+
+SALES = ['Fabien', 'Marine', 'Sébastien', 'Silvia', 'Sophie', 'Transfaire']
+DEPTS = {'22': (48.5, -2.8), '29': (48.2, -4.1), '35': (48.1, -1.7), '44': (47.3, -1.7),
+         '49': (47.4, -0.6), '50': (49.0, -1.3), '53': (48.1, -0.7), '56': (47.8, -2.8)}
+EQT = ['TPA', 'Epi', 'Roto', 'Robot', 'Autre']
+BRANDS = ['Boumatic', 'Delaval', 'Fullwood', 'Gascoigne-Melotte', 'GEA', 'Lely', 'Manus', 'Surge', 'Autre']
+PRODUCTS = ['M²erlin', 'Barn-E', 'Nano', 'Moov', 'Racleur', 'Autre']
+FARM_FORMS = ['GAEC', 'EARL', 'SCEA', 'Ferme']
+FARM_NAMES = ['du Bois', 'des Chênes', 'de la Lande', 'du Moulin', 'des Prés', 'de Kerhir', 'du Rocher', 'de la Vallée']
+
+
+def synthetic_visitors(rows, seed=SEED):
+
+    # Visitors of a 3 day show, with ~5% of farms recorded twice and a few missing values like real entries
+    rng = np.random.default_rng(seed)
+    depts = np.array(list(DEPTS))
+    dept = depts[rng.integers(len(depts), size=rows)]
+    centres = np.array([DEPTS[code] for code in dept])
+    zip = np.char.add(dept.astype(str), np.char.zfill(rng.integers(0, 1000, size=rows).astype(str), 3))
+    farm_id = rng.integers(0, max(int(rows * 0.95), 1), size=rows)
+    combos = [[PRODUCTS[i] for i in range(len(PRODUCTS)) if mask >> i & 1] for mask in range(2 ** len(PRODUCTS))]
+    product = np.empty(rows, dtype=object)
+    product[:] = [combos[mask] for mask in rng.integers(0, len(combos), size=rows)]
+
+    df = pd.DataFrame({
+        'date': pd.Timestamp('2024-09-10 09:00') + pd.to_timedelta(rng.integers(0, 3 * 24 * 3600, size=rows), unit='s'),
+        'sales': np.array(SALES)[rng.integers(len(SALES), size=rows)],
+        'farm': [f'{FARM_FORMS[i % 4]} {FARM_NAMES[i % 8]} {i}' for i in farm_id],
+        'name': [f'Exploitant {i}' for i in farm_id],
+        'address': [f'{i % 120 + 1} lieu-dit {FARM_NAMES[i % 8]}' for i in farm_id],
+        'zip': zip,
+        'dept': dept,
+        'city': np.char.add('Commune ', zip),
+        'mobile': [f'06{i:08d}' for i in farm_id],
+        'cows': rng.integers(20, 400, size=rows),
+        'eqt': np.array(EQT)[rng.integers(len(EQT), size=rows)],
+        'brand': np.array(BRANDS)[rng.integers(len(BRANDS), size=rows)],
+        'product': product,
+        'lat': centres[:, 0] + rng.normal(0, 0.3, size=rows),
+        'lon': centres[:, 1] + rng.normal(0, 0.3, size=rows),
+    }, columns=visitor_store.STORE_COLUMNS)
+
+    # Entries without address (geocoding failed) or without mobile
+    df.loc[rng.random(rows) < 0.02, ['lat', 'lon']] = np.nan
+    df.loc[rng.random(rows) < 0.1, 'mobile'] = None
+
+    return df
+
+
+def stub_network():
+
+    # Nominatim answers at once with the commune centre, the postal code API finds nothing
+    visitor_geo._geocode_cache = {}
+    visitor_geo._centroids = {}
+    visitor_geo._nominatim = lambda query: DEPTS['35']
+    visitor_geo._fetch_json = lambda url, timeout=None: []
+    visitor_geo._remember = lambda key, lat, lon: visitor_geo._geocode_cache.__setitem__(key, (lat, lon))
+
+
+def best_time(step, repeat=REPEAT):
+
+    # Fastest of `repeat` runs, in seconds
+    best = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def map_figure(df):
+
+    # Map construction of the app, imported here only (streamlit runs in bare mode)
+    import visitor_app
+
+    return visitor_app.map_figure(df)
+
+
+def bench_dataset(path, rows, repeat=REPEAT):
+
+    # {step: seconds} for one dataset
+    results = {}
+    visitor_store.open_store(path).write_base(synthetic_visitors(rows))
+
+    def cold_load():
+        visitor_store._frames.pop(path, None)
+        visitor_store.load_store(path)
+
+    results['select_dataset_cold'] = best_time(cold_load, repeat)
+    results['select_dataset_warm'] = best_time(lambda: visitor_store.load_store(path), repeat)
+
+    df = visitor_store.load_store(path)
+    options = SALES[:3]
+    colors = dict(zip(options, ['red', 'lime', 'magenta']))
+
+    results['query_stores'] = best_time(lambda: visitor_store.query_stores([path], {'sales': options}), repeat)
+    results['distinct_values'] = best_time(lambda: visitor_store.distinct_values([path], 'product'), repeat)
+
+    df_map = visitor_store.query_stores([path], {'sales': options})
+    results['legend_counts'] = best_time(lambda: df_map['sales'].value_counts(), repeat)
+    results['color_mapping'] = best_time(lambda: df_map.assign(color=df_map['sales'].map(colors)), repeat)
+    results['product_explode'] = best_time(lambda: df_map.explode('product'), repeat)
+
+    results['analytics_counts'] = best_time(lambda: visitor_stats.build_counts(df), repeat)
+    counts = visitor_stats.build_counts(df)
+    results['analytics_frames'] = best_time(lambda: [visitor_stats.count_frame(counts, column) for column in visitor_stats.COUNT_COLUMNS], repeat)
+
+    results['duplicate_index'] = best_time(lambda: visitor_dedup.build_index(df), repeat)
+    results['deduplicate'] = best_time(lambda: visitor_dedup.deduplicate(df), repeat)
+
+    results['map_figure'] = best_time(lambda: map_figure(df_map), repeat)
+
+    # add_visitor: geocoding (stubbed) and journal append of one visitor, with the caches listening
+    visitor_stats.load_counts(path)
+    visitor_dedup.load_index(path)
+    row = synthetic_visitors(1, seed=rows).iloc[0].to_dict()
+    row.update(date=visitor_store.format_date(row['date']), lat=None, lon=None)
+
+    def submissions():
+        for _ in range(APPEND_CALLS):
+            visitor_queue._process({'db': path, 'data': dict(row)})
+
+    results['add_visitor'] = best_time(submissions, 1) / APPEND_CALLS
+
+    return results
+
+
+def run(row_counts, backends, repeat=REPEAT):
+
+    stub_network()
+
+    # Warm up: plotly and the app are imported before the first timed step
+    map_figure(synthetic_visitors(10))
+
+    workdir = tempfile.mkdtemp(prefix='visitor_bench_')
+    results = {}
+
+    try:
+        for backend in backends:
+            for rows in row_counts:
+                path = os.path.join(workdir, f'visitors_{rows}.{backend}')
+                started = time.perf_counter()
+                for step, seconds in bench_dataset(path, rows, repeat).items():
+                    results[f'{backend}/{rows}/{step}'] = seconds
+                print(f'{backend} {rows} rows: {time.perf_counter() - started:.1f} s', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'meta': {'date': pd.Timestamp.now().strftime(visitor_store.DATE_FORMAT),
+                     'python': platform.python_version(),
+                     'pandas': pd.__version__,
+                     'machine': platform.machine(),
+                     'repeat': repeat},
+            'results': results}
+
+
+def compare(results, baseline, ratio=REGRESSION_RATIO):
+
+    # [(name, baseline seconds, seconds)] of the steps slower than ratio x baseline
+    regressions = []
+
+    for name, seconds in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is not None and seconds > reference * ratio and seconds - reference > NOISE_FLOOR:
+            regressions.append((name, reference, seconds))
+
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the visitor store, statistics and map on synthetic datasets')
+    parser.add_argument('--rows', default=','.join(str(rows) for rows in DEFAULT_ROWS), help='comma separated dataset sizes')
+    parser.add_argument('--backends', default='csv', help='comma separated list of csv, parquet, sqlite')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help='record the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    report = run([int(rows) for rows in args.rows.split(',')], args.backends.split(','), args.repeat)
+
+    for name, seconds in sorted(report['results'].items()):
+        print(f'{name:<45} {seconds * 1000:>10.2f} ms')
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline saved in {args.baseline}')
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+
+    regressions = compare(report['results'], baseline)
+
+    for name, reference, seconds in regressions:
+        print(f'REGRESSION {name}: {reference * 1000:.2f} ms -> {seconds * 1000:.2f} ms')
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Duplicate visitors: the same farm recorded by several SAMs or resellers.
+
+Two visitors are the same farm when they share a mobile number, or when
+their farm names match (exactly or above FUZZY_RATIO once legal forms and
+accents are removed) within the same postal code. Postal codes are used as
+blocks: names are only compared inside a block, which holds a handful of
+farms, so lookups cost O(1) and a full deduplication stays near O(N).
+"""
+import difflib
+import re
+import threading
+import unicodedata
+
+import pandas as pd
+
+import visitor_metrics
+import visitor_store
+
+FUZZY_RATIO = 0.85
+FUZZY_MIN_LENGTH = 6 # Short names ('f1', 'f10') are only matched exactly
+LEGAL_FORMS = {'gaec', 'earl', 'scea', 'sarl', 'sas', 'sa', 'ferme', 'exploitation', 'elevage',
+               'de', 'du', 'des', 'la', 'le', 'les', 'l', 'd'}
+
+# {path: (version, DuplicateIndex)}
+_indexes = {}
+_lock = threading.Lock()
+
+
+def farm_key(farm):
+
+    # 'GAEC de la Ferme du Bois-Joli' -> 'bois joli'
+    if visitor_store.is_missing(farm):
+        return ''
+
+    text = unicodedata.normalize('NFKD', str(farm))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    tokens = re.split(r'[^a-z0-9]+', text)
+
+    return ' '.join(token for token in tokens if token and token not in LEGAL_FORMS)
+
+
+def mobile_key(mobile):
+
+    # '+33 6 12 34 56 78' and '06.12.34.56.78' -> '612345678'
+    if visitor_store.is_missing(mobile):
+        return ''
+
+    digits = re.sub(r'\D', '', str(mobile))
+
+    return digits[-9:] if len(digits) >= 9 else ''
+
+
+def zip_key(zip):
+
+    if visitor_store.is_missing(zip):
+        return ''
+
+    return str(zip).strip().zfill(5)
+
+
+def similar(a, b):
+
+    if a == b:
+        return True
+
+    # Typos only: numbers must be the same ('ferme 12' is not 'ferme 13')
+    if min(len(a), len(b)) < FUZZY_MIN_LENGTH or re.findall(r'\d+', a) != re.findall(r'\d+', b):
+        return False
+
+    return difflib.SequenceMatcher(None, a, b).ratio() >= FUZZY_RATIO
+
+
+class DuplicateIndex:
+
+    # Visitors by mobile and by (postal code, farm name)
+    # Shared by every session and filled by the queue worker: add and find hold the index lock
+
+    def __init__(self):
+
+        self.rows = []
+        self.by_mobile = {}
+        self.by_zip = {}
+        self.lock = threading.Lock()
+
+    def add(self, data):
+
+        row = {column: data.get(column) for column in ['farm', 'name', 'zip', 'sales', 'date']}
+        mobile = mobile_key(data.get('mobile'))
+        farm = farm_key(data.get('farm'))
+
+        with self.lock:
+
+            position = len(self.rows)
+            self.rows.append(row)
+
+            if mobile:
+                self.by_mobile.setdefault(mobile, []).append(position)
+
+            if farm:
+                self.by_zip.setdefault(zip_key(data.get('zip')), {}).setdefault(farm, []).append(position)
+
+    def find(self, farm, mobile, zip):
+
+        # Positions of the visitors that look like this farm
+        mobile = mobile_key(mobile)
+        farm = farm_key(farm)
+
+        with self.lock:
+
+            found = set(self.by_mobile.get(mobile, []))
+
+            if farm:
+                for name, positions in self.by_zip.get(zip_key(zip), {}).items():
+                    if similar(farm, name):
+                        found.update(positions)
+
+            return [self.rows[position] for position in sorted(found)]
+
+
+def build_index(df):
+
+    index = DuplicateIndex()
+
+    for data in df[['farm', 'name', 'zip', 'sales', 'date', 'mobile']].to_dict('records'):
+        index.add(data)
+
+    return index
+
+
+def on_append(path, before, after, rows):
+
+    # Same bookkeeping as the visitor counts
+    with _lock:
+
+        cached = _indexes.get(path)
+
+        if cached is None:
+            return
+
+        if cached[0] != before:
+            del _indexes[path]
+            return
+
+        for data in rows:
+            cached[1].add(data)
+        _indexes[path] = (after, cached[1])
+
+
+visitor_store.add_listener(on_append)
+
+
+def load_index(path):
+
+    version = visitor_store.store_version(path)
+
+    with _lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[0] == version:
+            visitor_metrics.cache('duplicate_index', True)
+            return cached[1]
+
+    visitor_metrics.cache('duplicate_index', False)
+
+    if cached is not None:
+        # Written by another process: index the new rows only
+        version, rows = visitor_store.changes_since(path, cached[0])
+        if rows is not None:
+            with _lock:
+                if _indexes.get(path) is cached:
+                    for data in rows[['farm', 'name', 'zip', 'sales', 'date', 'mobile']].to_dict('records'):
+                        cached[1].add(data)
+                    _indexes[path] = (version, cached[1])
+                    return cached[1]
+
+    version, df = visitor_store.versioned_store(path)
+    index = build_index(df)
+
+    with _lock:
+        _indexes[path] = (version, index)
+
+    return index
+
+
+@visitor_metrics.timed('find_duplicates')
+def find_duplicates(paths, farm, mobile, zip):
+
+    # {path: [matching visitors]} over several datasets
+    found = {}
+
+    for path in paths:
+        matches = load_index(path).find(farm, mobile, zip)
+        if matches:
+            found[path] = matches
+
+    return found
+
+
+def duplicate_groups(df):
+
+    # Group number of every row, rows of the same farm share the same number
+    parent = list(range(len(df)))
+
+    def root(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    def union(a, b):
+        parent[root(a)] = root(b)
+
+    farms = [farm_key(farm) for farm in df['farm']]
+    zips = [zip_key(zip) for zip in df['zip']]
+    first = {}
+
+    # Same mobile anywhere
+    for position, mobile in enumerate(mobile_key(mobile) for mobile in df['mobile']):
+        if mobile:
+            union(position, first.setdefault(('mobile', mobile), position))
+
+    # Same or similar farm name inside a postal code block
+    blocks = {}
+    for position, (code, farm) in enumerate(zip(zips, farms)):
+        if farm:
+            blocks.setdefault(code, {}).setdefault(farm, []).append(position)
+
+    for names in blocks.values():
+        keys = list(names)
+        for i, name in enumerate(keys):
+            for position in names[name][1:]:
+                union(position, names[name][0])
+            for other in keys[i + 1:]:
+                if similar(name, other):
+                    union(names[name][0], names[other][0])
+
+    return pd.Series([root(position) for position in range(len(df))], index=df.index)
+
+
+def deduplicate(df):
+
+    # One row per farm (its first record), with the number of records merged into it
+    if len(df) == 0:
+        return df
+
+    groups = duplicate_groups(df)
+    first = ~groups.duplicated()
+
+    return df[first].assign(records=groups.map(groups.value_counts())[first])
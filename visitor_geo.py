@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Geographic helpers: postal code -> commune lookup and geocoding.
+
+The postal code index is built once per process from a local copy of the
+communes dataset of geo.api.gouv.fr (COMMUNES_FILE, see refresh_communes).
+When that copy is missing or older than COMMUNES_MAX_AGE, loading the index
+downloads it again in a background thread and adds it to the live index.
+The API is only called for postal codes missing from the index, with a
+short timeout, and answers are kept in the index for the other sessions;
+unknown postal codes and failed calls are not asked again for
+ZIP_MISS_TTL / ZIP_ERROR_TTL seconds.
+
+Both services are called through visitor_http (shared keep-alive session,
+retries, circuit breaker).
+
+Geocoding results are memoized in GEOCODE_CACHE_FILE (one JSON line per
+normalized address), so a known farm is never sent to Nominatim twice.
+When Nominatim has no answer (or is unreachable) the commune centroid is
+used instead, without being cached: such coordinates are approximate and
+`python visitor_geo.py backfill` geocodes their rows again.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unicodedata
+
+import visitor_http
+import visitor_metrics
+
+GEO_API = 'https://geo.api.gouv.fr/communes'
+COMMUNES_FILE = './data/communes.json'
+COMMUNES_FIELDS = 'nom,code,codesPostaux,codeDepartement,centre'
+API_TIMEOUT = 3
+API_RETRIES = 1 # The form waits for the answer: one retry only
+COMMUNES_MAX_AGE = 30 * 24 * 3600 # Download the communes dataset again after a month
+ZIP_MISS_TTL = 3600 # Seconds before an unknown postal code is asked again
+ZIP_ERROR_TTL = 60 # Seconds before a postal code is asked again after a network error
+GEOCODE_CACHE_FILE = './data/geocode_cache.jsonl'
+GEOCODER_AGENT = 'visitus'
+GEOCODER_DOMAIN = 'nominatim.openstreetmap.org'
+GEOCODER_SCHEME = 'https'
+GEOCODER_TIMEOUT = 5
+GEOCODER_DELAY = 1 # Nominatim usage policy: 1 request per second at most
+
+_index_lock = threading.Lock()
+_geocode_lock = threading.Lock()
+_nominatim_lock = threading.Lock()
+_geocode_cache = None
+# {zip: time.monotonic() before which the API is not called again}
+_zip_misses = {}
+_refresh = None
+_centroids = None
+_geolocator = None
+_last_geocode = 0.0
+
+
+@visitor_metrics.timed('geo_api')
+def _fetch_json(url, timeout=API_TIMEOUT, retries=API_RETRIES):
+
+    response = visitor_http.get(url, timeout=timeout, retries=retries)
+    response.raise_for_status()
+
+    visitor_metrics.payload('geo_api', len(response.content))
+
+    return response.json()
+
+
+def refresh_communes(path=COMMUNES_FILE, timeout=60):
+
+    # Download the whole communes dataset (~35k rows) for offline use
+    communes = _fetch_json(f'{GEO_API}?fields={COMMUNES_FIELDS}&format=json', timeout=timeout, retries=visitor_http.RETRIES)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(communes, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+    return len(communes)
+
+
+def _read_zip_index(path):
+
+    index = {}
+
+    with open(path, encoding='utf-8') as f:
+        communes = json.load(f)
+
+    for info in communes:
+        for zip in info.get('codesPostaux', []):
+            index.setdefault(zip, []).append(info['nom'])
+
+    return index
+
+
+def _refresh_index(index, path):
+
+    # Download the communes dataset, then add it to the index the sessions already use
+    global _refresh
+
+    try:
+        refresh_communes(path)
+        communes = _read_zip_index(path)
+    except (OSError, ValueError):
+        return # Offline: the API answers the postal codes one by one meanwhile
+    finally:
+        _refresh = None
+
+    with _index_lock:
+        index.update(communes)
+
+
+def load_zip_index(path=COMMUNES_FILE, max_age=COMMUNES_MAX_AGE):
+
+    # Build a {zip: [commune names]} index from the local communes dataset, refreshed in background when stale
+    global _refresh
+
+    index = _read_zip_index(path) if os.path.isfile(path) else {}
+    stale = not os.path.isfile(path) or time.time() - os.path.getmtime(path) > max_age
+
+    with _index_lock:
+        if stale and _refresh is None:
+            _refresh = threading.Thread(target=_refresh_index, args=(index, path), name='communes-refresh', daemon=True)
+            _refresh.start()
+
+    return index
+
+
+def lookup_zip(index, zip, timeout=API_TIMEOUT):
+
+    # Return the communes of a postal code, asking the API only on a cache miss
+    noms_ville = index.get(zip)
+    visitor_metrics.cache('zip_index', noms_ville is not None)
+
+    if noms_ville is not None:
+        return noms_ville
+
+    with _index_lock:
+        if _zip_misses.get(zip, 0) > time.monotonic():
+            return []
+
+    try:
+        json_lisible = _fetch_json(f'{GEO_API}?codePostal={zip}&fields=nom', timeout=timeout)
+    except (OSError, ValueError):
+        # Network down, circuit open or invalid answer: let the caller fall back to a free text
+        with _index_lock:
+            _zip_misses[zip] = time.monotonic() + ZIP_ERROR_TTL
+        return []
+
+    noms_ville = [info['nom'] for info in json_lisible]
+
+    with _index_lock:
+        if noms_ville:
+            index[zip] = noms_ville
+        else:
+            _zip_misses[zip] = time.monotonic() + ZIP_MISS_TTL
+
+    return noms_ville
+
+
+def format_zip(zip):
+
+    # Postal codes read back from a CSV are numbers: 1000 -> '01000'
+    if zip is None or zip != zip:
+        return ''
+
+    if isinstance(zip, float):
+        zip = int(zip)
+
+    return str(zip).strip().zfill(5)
+
+
+def normalize_key(address, zip, city):
+
+    # Cache key: lower case, no accents, single spaces
+    parts = []
+
+    for part in (address, format_zip(zip), city):
+        if part is None or part != part: # None or NaN read from a CSV
+            part = ''
+        text = unicodedata.normalize('NFKD', str(part))
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+        parts.append(' '.join(text.lower().replace(',', ' ').split()))
+
+    return '|'.join(parts)
+
+
+def load_centroids(path=COMMUNES_FILE):
+
+    # Build {(zip, commune name): (lat, lon)} plus a {zip: (lat, lon)} fallback
+    centroids = {}
+
+    if os.path.isfile(path):
+
+        with open(path, encoding='utf-8') as f:
+            communes = json.load(f)
+
+        for info in communes:
+            centre = info.get('centre')
+            if not centre:
+                continue
+            lon, lat = centre['coordinates']
+            for zip in info.get('codesPostaux', []):
+                centroids[(zip, normalize_key('', '', info['nom']))] = (lat, lon)
+                centroids.setdefault(zip, (lat, lon))
+
+    return centroids
+
+
+def _load_geocode_cache(path=GEOCODE_CACHE_FILE):
+
+    cache = {}
+
+    if os.path.isfile(path):
+
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Truncated last line after a crash
+                cache[entry['key']] = (entry['lat'], entry['lon'])
+
+    return cache
+
+
+def _remember(key, lat, lon, path=GEOCODE_CACHE_FILE):
+
+    _geocode_cache[key] = (lat, lon)
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'key': key, 'lat': lat, 'lon': lon}) + '\n')
+
+
+def _shared_adapter(**kwargs):
+
+    # geopy adapter sending the Nominatim requests through visitor_http
+    from geopy.adapters import BaseSyncAdapter
+
+    class SharedAdapter(BaseSyncAdapter):
+
+        def get_json(self, url, *, timeout, headers):
+            return visitor_http.get_json(url, timeout=timeout, retries=API_RETRIES, headers=headers)
+
+        def get_text(self, url, *, timeout, headers):
+            return visitor_http.get(url, timeout=timeout, retries=API_RETRIES, headers=headers).text
+
+    return SharedAdapter(**kwargs)
+
+
+@visitor_metrics.timed('nominatim')
+def _nominatim(query):
+
+    # One shared client, throttled to GEOCODER_DELAY between two requests
+    global _geolocator, _last_geocode
+
+    with _nominatim_lock:
+
+        if _geolocator is None:
+            from geopy.geocoders import Nominatim
+            _geolocator = Nominatim(user_agent=GEOCODER_AGENT, timeout=GEOCODER_TIMEOUT, domain=GEOCODER_DOMAIN,
+                                    scheme=GEOCODER_SCHEME, adapter_factory=_shared_adapter)
+
+        wait = _last_geocode + GEOCODER_DELAY - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        try:
+            location = _geolocator.geocode(query)
+        except Exception:
+            # geopy raises GeopyError subclasses, but also socket errors on timeouts
+            location = None
+        finally:
+            _last_geocode = time.monotonic()
+
+    if location is None:
+        return None
+
+    return location.latitude, location.longitude
+
+
+def _load_caches():
+
+    global _geocode_cache, _centroids
+
+    if _geocode_cache is None:
+        _geocode_cache = _load_geocode_cache()
+        _centroids = load_centroids()
+
+
+def cached_geocode(address, zip, city):
+
+    # Geocode cache, then commune centroid: never calls Nominatim (bulk imports)
+    zip = format_zip(zip)
+
+    with _geocode_lock:
+
+        _load_caches()
+        coords = _geocode_cache.get(normalize_key(address, zip, city))
+
+    visitor_metrics.cache('geocode', coords is not None)
+
+    if coords is None:
+        coords = _centroids.get((zip, normalize_key('', '', city))) or _centroids.get(zip)
+
+    return coords if coords is not None else (None, None)
+
+
+def _locate(address, zip, city, country='France'):
+
+    # ((lat, lon), precise): only the addresses found by Nominatim are precise and cached
+    zip = format_zip(zip)
+    key = normalize_key(address, zip, city)
+    commune = normalize_key('', zip, city)
+
+    with _geocode_lock:
+
+        _load_caches()
+        visitor_metrics.cache('geocode', key in _geocode_cache)
+
+        if key in _geocode_cache:
+            return _geocode_cache[key], key != commune
+
+    query = ', '.join(str(part) for part in (address, zip, city, country) if part and part == part)
+    coords = _nominatim(query)
+
+    if coords is not None:
+        with _geocode_lock:
+            _remember(key, *coords)
+        return coords, key != commune
+
+    # Commune centroid, then postal code centroid, then the commune through Nominatim (cached as the commune)
+    coords = _centroids.get((zip, normalize_key('', '', city))) or _centroids.get(zip) or _geocode_cache.get(commune)
+
+    if coords is None and address:
+        coords = _nominatim(f'{zip}, {city}, {country}')
+        if coords is not None:
+            with _geocode_lock:
+                _remember(commune, *coords)
+
+    return (coords, False) if coords is not None else ((None, None), False)
+
+
+@visitor_metrics.timed('geocode')
+def geocode(address, zip, city, country='France'):
+
+    # Return (lat, lon) of an address, (None, None) when nothing was found
+    return _locate(address, zip, city, country)[0]
+
+
+def is_approximate(lat, lon, zip, city):
+
+    # Coordinates of a commune instead of the farm (geocoding failed when the visitor was recorded)
+    zip = format_zip(zip)
+
+    with _geocode_lock:
+        _load_caches()
+        centres = [_centroids.get((zip, normalize_key('', '', city))), _centroids.get(zip),
+                   _geocode_cache.get(normalize_key('', zip, city))]
+
+    return any(centre is not None and round(centre[0], 6) == round(lat, 6) and round(centre[1], 6) == round(lon, 6)
+               for centre in centres)
+
+
+def backfill_coordinates(path):
+
+    # Geocode the rows of a dataset without lat/lon or at their commune centre, at Nominatim's pace (CLI only)
+    import pandas as pd
+    import visitor_store
+
+    df = visitor_store.read_store(path)
+    missing = df['lat'].isna() | df['lon'].isna()
+    approximate = pd.Series([not absent and is_approximate(lat, lon, code, city)
+                             for absent, lat, lon, code, city in zip(missing, df['lat'], df['lon'], df['zip'], df['city'])],
+                            index=df.index, dtype=bool)
+    retry = missing | approximate
+    found = {}
+
+    for row, absent in zip(df[retry].itertuples(), missing[retry]):
+        key = normalize_key(row.address, row.zip, row.city)
+        if key not in found:
+            coords, precise = _locate(row.address, row.zip, row.city)
+            # A centroid only replaces missing coordinates
+            if precise or absent:
+                found[key] = coords
+
+    return visitor_store.fill_coordinates(path, found, normalize_key, is_approximate)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'backfill':
+        for dataset in sys.argv[2:]:
+            print(f'{backfill_coordinates(dataset)} rows geocoded in {dataset}')
+    else:
+        print(f'{refresh_communes()} communes saved in {COMMUNES_FILE}')
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Outbound HTTP shared by the postal code lookups and the geocoder.
+
+One requests session per process keeps the connections to geo.api.gouv.fr
+and Nominatim alive (POOL_SIZE per host), so a lookup does not pay a new
+TCP + TLS handshake. Every call has a timeout, is retried on connection
+errors and 429/5xx answers with an exponential backoff, and waits for one of
+MAX_CONCURRENT slots of its host: a slow service cannot hold every thread.
+
+After BREAKER_FAILURES failed calls in a row a host is considered down: its
+calls fail at once with Unavailable for BREAKER_COOLDOWN seconds, then a
+single trial call closes the circuit again or keeps it open. At a show
+without network the form falls back to free text instead of freezing.
+
+Service URLs are constants of the callers (visitor_geo.GEO_API,
+GEOCODER_DOMAIN), point them to a local stub server to test.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = 5
+RETRIES = 2
+RETRY_STATUS = (429, 500, 502, 503, 504)
+BACKOFF = 0.5 # Seconds before the first retry, doubled for each following one
+BACKOFF_MAX = 4
+POOL_SIZE = 4
+MAX_CONCURRENT = 4
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 30
+
+_session = None
+_breakers = {}
+_slots = {}
+_lock = threading.Lock()
+
+
+class Unavailable(OSError):
+
+    # Host down, saturated or answering errors: callers handle it like any network error
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+
+        self.failures = failures
+        self.cooldown = cooldown
+        self.count = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+
+        with self.lock:
+
+            if self.opened is None:
+                return True
+
+            if time.monotonic() - self.opened >= self.cooldown:
+                # One trial call, the others keep failing fast until it answers
+                self.opened = time.monotonic()
+                return True
+
+            return False
+
+    def success(self):
+
+        with self.lock:
+            self.count = 0
+            self.opened = None
+
+    def failure(self):
+
+        with self.lock:
+            self.count += 1
+            if self.count >= self.failures:
+                self.opened = time.monotonic()
+
+
+def session():
+
+    # Process-wide session, its connections are kept alive between calls
+    global _session
+
+    with _lock:
+
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+        return _session
+
+
+def _host(url):
+
+    host = urlsplit(url).netloc
+
+    with _lock:
+
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+            _slots[host] = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+        return _breakers[host], _slots[host]
+
+
+def _backoff(attempt, response=None):
+
+    # Retry-After of a 429/503 answer when it is short, exponential backoff otherwise
+    delay = min(BACKOFF * 2 ** attempt, BACKOFF_MAX)
+
+    if response is not None:
+        try:
+            delay = min(max(float(response.headers.get('Retry-After', delay)), 0), BACKOFF_MAX)
+        except ValueError:
+            pass # HTTP date instead of seconds
+
+    time.sleep(delay)
+
+
+def get(url, timeout=TIMEOUT, retries=RETRIES, headers=None):
+
+    # GET through the shared session, return the response (raises Unavailable when the host did not answer)
+    breaker, slots = _host(url)
+
+    if not breaker.allow():
+        raise Unavailable(f"{urlsplit(url).netloc} indisponible, nouvel essai dans {breaker.cooldown} s")
+
+    if not slots.acquire(timeout=timeout):
+        raise Unavailable(f"{urlsplit(url).netloc} saturé")
+
+    try:
+
+        error = None
+
+        for attempt in range(retries + 1):
+
+            try:
+                response = session().get(url, timeout=timeout, headers=headers)
+            except requests.RequestException as exception:
+                error, response = exception, None
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    breaker.success()
+                    return response
+                error = Unavailable(f"{urlsplit(url).netloc} : erreur {response.status_code}")
+
+            if attempt < retries:
+                _backoff(attempt, response)
+
+        breaker.failure()
+        raise Unavailable(str(error)) from error
+
+    finally:
+        slots.release()
+
+
+def get_json(url, timeout=TIMEOUT, retries=RETRIES, headers=None):
+
+    response = get(url, timeout=timeout, retries=retries, headers=headers)
+    response.raise_for_status()
+
+    return response.json()
+
+
+def reset():
+
+    # Close the pooled connections and forget the state of every host
+    global _session
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _breakers.clear()
+        _slots.clear()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Bulk import of visitor lists (CSV or Excel files received after a show).
+
+Every check runs on whole columns: postal codes and departments are
+validated, eqt/brand/product are mapped onto the lists of the form, cities
+are resolved once per postal code and coordinates once per address (from
+the geocode cache or the commune centroid, Nominatim is left to
+`python visitor_geo.py backfill`). Rows already in the dataset, or twice
+in the file, are dropped with the rules of the form (same mobile, or close
+farm names in the same postal code, see visitor_dedup) before the valid
+rows are written in one append.
+"""
+import io
+
+import pandas as pd
+
+import visitor_dedup
+import visitor_geo
+import visitor_store
+
+OTHER = 'Autre'
+PRODUCT_SEPARATORS = r'\s*[,;|/+]\s*'
+
+
+def read_upload(data, name):
+
+    # CSV (';' or ',' separated) or Excel file -> DataFrame of text columns
+    if name.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(io.BytesIO(data), dtype=str)
+
+    return pd.read_csv(io.BytesIO(data), sep=None, engine='python', dtype=str)
+
+
+def normalize_text(series):
+
+    # Lower case, no accents, single spaces, on a whole column
+    return (series.fillna('').astype(str)
+            .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+            .str.lower().str.split().str.join(' '))
+
+
+def normalize_zip(series):
+
+    # '35000', '35000.0' (Excel) or '1000' -> '35000' / '01000'
+    return series.fillna('').astype(str).str.strip().str.replace(r'\.0$', '', regex=True).str.zfill(5)
+
+
+def zip_dept(series):
+
+    # Department of each postal code: 97x/98x overseas codes have 3 digits, Corsica (20xxx) is 2A up to 20199, 2B above
+    dept = series.str[:2]
+    dept = dept.mask(dept.isin(['97', '98']), series.str[:3])
+
+    return dept.mask(dept == '20', series.str[:3].map(lambda code: '2A' if code < '202' else '2B'))
+
+
+def dept_matches(dept, zip):
+
+    # Corsican postal codes do not follow 2A/2B exactly (20600 is 2B, 20137 is 2A): any of 20, 2A, 2B is accepted there
+    corsica = zip.str.startswith('20') & dept.isin(['20', '2A', '2B'])
+
+    return corsica | (dept == zip_dept(zip))
+
+
+def match_choices(series, choices, other=OTHER):
+
+    # Map free text onto the closest spelling of the list, unknown values become 'Autre'
+    lookup = dict(zip(normalize_text(pd.Series(choices)), choices))
+    matched = normalize_text(series).map(lookup)
+
+    return matched.where(matched.notna() | series.isna(), other)
+
+
+def split_products(series, choices):
+
+    # "Nano, moov" or "['Nano', 'Moov']" -> ['Nano', 'Moov'], mapped onto the product list
+    products = series.map(visitor_store.parse_products).explode().dropna().astype(str)
+    products = products.str.split(PRODUCT_SEPARATORS, regex=True).explode()
+    products = match_choices(products[products.str.strip() != ''], choices)
+
+    grouped = products.groupby(level=0).agg(lambda values: sorted(set(values)))
+
+    return pd.Series([grouped.get(index, []) for index in series.index], index=series.index, dtype=object)
+
+
+def resolve_cities(df, zip_index):
+
+    # One commune lookup per postal code, not per row
+    communes = {code: visitor_geo.lookup_zip(zip_index, code) for code in df['zip'].unique()}
+    official = {}
+
+    for code, names in communes.items():
+        for name, key in zip(names, normalize_text(pd.Series(names, dtype=object))):
+            official[(code, key)] = name
+
+    keys = zip(df['zip'], normalize_text(df['city']))
+    cities = pd.Series([official.get(key) for key in keys], index=df.index, dtype=object)
+    first = df['zip'].map(lambda code: communes[code][0] if communes[code] else None)
+
+    # Official spelling when the city matches, first commune of the postal code when it is missing
+    return cities.fillna(df['city'].where(df['city'].notna() & (df['city'] != ''), first))
+
+
+def resolve_coordinates(df):
+
+    # One lookup per distinct address, from the geocode cache or the commune centroid
+    addresses = df[['address', 'zip', 'city']].fillna('')
+    coords = {tuple(row): visitor_geo.cached_geocode(*row) for row in addresses.drop_duplicates().itertuples(index=False)}
+    found = [coords[tuple(row)] for row in addresses.itertuples(index=False)]
+
+    lat = pd.Series([lat for lat, lon in found], index=df.index, dtype='float64')
+    lon = pd.Series([lon for lat, lon in found], index=df.index, dtype='float64')
+
+    return df['lat'].fillna(lat), df['lon'].fillna(lon)
+
+
+def prepare_import(df, index, zip_index, eqt_list, brand_list, prod_list, sales=None):
+
+    # Return (rows to import, rejected rows with a 'motif' column), index is the DuplicateIndex of the target (or None)
+    df = df.rename(columns=lambda column: str(column).strip().lower())
+    df = df.reindex(columns=visitor_store.STORE_COLUMNS)
+
+    for column in ['lat', 'lon']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    df['zip'] = normalize_zip(df['zip'])
+    df['dept'] = df['dept'].fillna(zip_dept(df['zip'])).astype(str).str.strip().str.upper().str.zfill(2)
+    df['sales'] = df['sales'].fillna(sales)
+    df['date'] = visitor_store.parse_dates(df['date']).fillna(pd.Timestamp.now().floor('s'))
+    df['eqt'] = match_choices(df['eqt'], eqt_list)
+    df['brand'] = match_choices(df['brand'], brand_list)
+    df['product'] = split_products(df['product'], prod_list)
+
+    # Validation
+    motif = pd.Series('', index=df.index)
+    motif = motif.mask(df['farm'].fillna('').astype(str).str.strip() == '', 'Elevage manquant')
+    motif = motif.mask((motif == '') & ~df['zip'].str.fullmatch(r'\d{5}'), 'Code postal erroné')
+    motif = motif.mask((motif == '') & ~dept_matches(df['dept'], df['zip']), 'Département différent du code postal')
+
+    # Same mobile or same (or close) farm name in the postal code, the rules of the form
+    if index is not None:
+        known = pd.Series([bool(index.find(farm, mobile, zip)) for farm, mobile, zip in zip(df['farm'], df['mobile'], df['zip'])],
+                          index=df.index, dtype=bool)
+        motif = motif.mask((motif == '') & known, 'Déjà enregistré')
+
+    pending = motif == ''
+    twice = visitor_dedup.duplicate_groups(df[pending]).duplicated().reindex(df.index, fill_value=False)
+    motif = motif.mask(pending & twice, 'En double dans le fichier')
+
+    rejected = df[motif != ''].assign(motif=motif[motif != ''])
+    valid = df[motif == ''].copy()
+
+    if len(valid) != 0:
+        valid['city'] = resolve_cities(valid, zip_index)
+        valid['lat'], valid['lon'] = resolve_coordinates(valid)
+
+    return valid, rejected
+
+
+def import_visitors(path, valid):
+
+    # Single journal write / single SQLite transaction for the whole file
+    visitor_store.append_visitors(path, valid.to_dict('records'))
+
+    return len(valid)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Hot-path instrumentation: latency histograms, call counts, payload sizes and
+cache hit rates of the store, geocoding and rendering functions.
+
+Disabled unless VISITUS_METRICS=1 is set before the app starts: `timed`
+then returns the decorated function itself and the other recorders return
+at once, so production pays nothing. When enabled, the measures are shown
+on the admin "Performance" page and written every METRICS_FLUSH seconds to
+METRICS_FILE in the Prometheus text format (node_exporter textfile style).
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('VISITUS_METRICS') == '1'
+METRICS_FILE = './data/metrics.prom'
+METRICS_FLUSH = 15 # Seconds between two writes of METRICS_FILE
+METRIC_PREFIX = 'visitus'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# {name: [bucket counts..., +Inf count]}, {name: [count, sum, max]}
+_latency = {}
+_latency_stats = {}
+_payload = {}
+# {name: [hits, misses]}
+_cache = {}
+_lock = threading.Lock()
+_writer = None
+
+
+def observe(name, seconds):
+
+    # Add one call of `seconds` to the latency histogram of `name`
+    if not ENABLED:
+        return
+
+    with _lock:
+
+        buckets = _latency.get(name)
+
+        if buckets is None:
+            buckets = _latency[name] = [0] * (len(LATENCY_BUCKETS) + 1)
+            _latency_stats[name] = [0, 0.0, 0.0]
+
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats = _latency_stats[name]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    _start_writer()
+
+
+def payload(name, nbytes):
+
+    # Size of what was read, fetched or sent to the browser
+    if not ENABLED:
+        return
+
+    with _lock:
+        stats = _payload.setdefault(name, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += nbytes
+        stats[2] = max(stats[2], nbytes)
+
+
+def cache(name, hit):
+
+    if not ENABLED:
+        return
+
+    with _lock:
+        _cache.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+
+@contextmanager
+def timer(name):
+
+    # with timer('plotly_chart'): ... (a bare yield when disabled)
+    if not ENABLED:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def timed(name):
+
+    # Decorator recording the latency of every call, the function is left untouched when disabled
+    def decorator(func):
+
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def _quantile(buckets, count, q):
+
+    # Upper bound of the bucket holding the q-quantile (Prometheus histogram_quantile without interpolation)
+    rank = q * count
+    seen = 0
+
+    for bound, bucket in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+        seen += bucket
+        if seen >= rank:
+            return bound
+
+    return float('inf')
+
+
+def snapshot():
+
+    # Plain rows for the Performance page
+    with _lock:
+
+        latency = []
+        for name, buckets in sorted(_latency.items()):
+            count, total, slowest = _latency_stats[name]
+            latency.append({'name': name, 'count': count, 'mean_ms': 1000 * total / count,
+                            'p50_ms': 1000 * min(_quantile(buckets, count, 0.5), slowest),
+                            'p95_ms': 1000 * min(_quantile(buckets, count, 0.95), slowest),
+                            'max_ms': 1000 * slowest})
+
+        payloads = [{'name': name, 'count': count, 'mean_kb': total / count / 1024, 'max_kb': largest / 1024}
+                    for name, (count, total, largest) in sorted(_payload.items())]
+
+        caches = [{'name': name, 'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+                  for name, (hits, misses) in sorted(_cache.items())]
+
+    return latency, payloads, caches
+
+
+def prometheus_text():
+
+    lines = [f'# TYPE {METRIC_PREFIX}_latency_seconds histogram']
+
+    with _lock:
+
+        for name, buckets in sorted(_latency.items()):
+            seen = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+                seen += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{METRIC_PREFIX}_latency_seconds_bucket{{name="{name}",le="{le}"}} {seen}')
+            count, total, slowest = _latency_stats[name]
+            lines.append(f'{METRIC_PREFIX}_latency_seconds_sum{{name="{name}"}} {total}')
+            lines.append(f'{METRIC_PREFIX}_latency_seconds_count{{name="{name}"}} {count}')
+
+        lines.append(f'# TYPE {METRIC_PREFIX}_payload_bytes summary')
+        for name, (count, total, largest) in sorted(_payload.items()):
+            lines.append(f'{METRIC_PREFIX}_payload_bytes_sum{{name="{name}"}} {total}')
+            lines.append(f'{METRIC_PREFIX}_payload_bytes_count{{name="{name}"}} {count}')
+
+        lines.append(f'# TYPE {METRIC_PREFIX}_cache_requests_total counter')
+        for name, (hits, misses) in sorted(_cache.items()):
+            lines.append(f'{METRIC_PREFIX}_cache_requests_total{{name="{name}",result="hit"}} {hits}')
+            lines.append(f'{METRIC_PREFIX}_cache_requests_total{{name="{name}",result="miss"}} {misses}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=METRICS_FILE):
+
+    # Atomic replace, the scraper never reads a half written file
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def _flush():
+
+    while True:
+        time.sleep(METRICS_FLUSH)
+        try:
+            write_prometheus()
+        except OSError:
+            pass # Data directory not writable: the Performance page still works
+
+
+def _start_writer():
+
+    global _writer
+
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_flush, name='visitor-metrics', daemon=True)
+                _writer.start()
+
+
+def reset():
+
+    with _lock:
+        for measures in (_latency, _latency_stats, _payload, _cache):
+            measures.clear()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Background submission queue: "Valider" only records the visitor here and
+returns, a worker thread geocodes and stores it in the visitor store.
+
+Jobs are journaled in QUEUE_FILE before being acknowledged, so visitors
+submitted right before a restart are replayed when the worker starts again.
+A job is only marked done once stored: a failed one stays in QUEUE_FILE and
+is queued again after RETRY_DELAY seconds, doubled on each failure up to
+RETRY_MAX.
+"""
+import json
+import os
+import queue
+import threading
+import uuid
+
+import visitor_geo
+import visitor_metrics
+import visitor_store
+
+QUEUE_FILE = './data/submissions.jsonl'
+RETRY_DELAY = 5
+RETRY_MAX = 300
+
+PENDING = 'pending'
+SAVED = 'saved'
+FAILED = 'failed'
+
+_jobs = queue.Queue()
+_status = {}
+_file_lock = threading.Lock()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _journal(entry):
+
+    with _file_lock:
+        with open(QUEUE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _pending_jobs():
+
+    # Jobs of the queue file without a matching 'done' entry
+    jobs = {}
+
+    if os.path.isfile(QUEUE_FILE):
+
+        with open(QUEUE_FILE, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('done'):
+                    jobs.pop(entry['id'], None)
+                else:
+                    jobs[entry['id']] = entry
+
+    return list(jobs.values())
+
+
+@visitor_metrics.timed('submission')
+def _process(job):
+
+    data = job['data']
+
+    if data.get('lat') is None or data.get('lon') is None:
+        data['lat'], data['lon'] = visitor_geo.geocode(data.get('address'), data.get('zip'), data.get('city'))
+
+    visitor_store.append_visitor(job['db'], data)
+
+    if data['lat'] is None or data['lon'] is None:
+        # Kept without coordinates, 'python visitor_geo.py backfill' can retry later
+        return SAVED, 'Adresse introuvable, le visiteur est enregistré sans coordonnées.'
+
+    return SAVED, None
+
+
+def _retry(job):
+
+    # Queue the job again later, it stays in the queue file meanwhile
+    delay = min(RETRY_DELAY * 2 ** job['attempts'], RETRY_MAX)
+    job['attempts'] += 1
+
+    timer = threading.Timer(delay, _jobs.put, args=(job,))
+    timer.daemon = True
+    timer.start()
+
+    return delay
+
+
+def _run():
+
+    while True:
+
+        job = _jobs.get()
+        job.setdefault('attempts', 0)
+
+        try:
+            state, message = _process(job)
+        except Exception as error:
+            delay = _retry(job)
+            state, message = FAILED, f"{error} (nouvel essai automatique dans {delay:.0f} s)"
+        else:
+            _journal({'id': job['id'], 'done': True})
+
+        # Only while a session still waits for it: the outcome of a retry is not shown again once forgotten
+        if job['id'] in _status:
+            _status[job['id']] = {'state': state, 'message': message, 'db': job['db'], 'data': job['data']}
+
+        with _file_lock:
+            # Nothing left to replay: start the queue file over
+            if _jobs.empty() and not _pending_jobs():
+                os.remove(QUEUE_FILE)
+
+        _jobs.task_done()
+
+
+def start_worker():
+
+    # Start the worker once per process and replay the jobs left by a restart
+    global _worker
+
+    with _worker_lock:
+
+        if _worker is None or not _worker.is_alive():
+
+            for job in _pending_jobs():
+                _status[job['id']] = {'state': PENDING, 'message': None, 'db': job['db'], 'data': job['data']}
+                _jobs.put(job)
+
+            _worker = threading.Thread(target=_run, name='visitor-queue', daemon=True)
+            _worker.start()
+
+
+def submit(db, data):
+
+    # Queue a visitor for geocoding and storage, return its submission id
+    start_worker()
+
+    job = {'id': uuid.uuid4().hex, 'db': db, 'data': dict(data)}
+    _journal(job)
+    _status[job['id']] = {'state': PENDING, 'message': None, 'db': db, 'data': job['data']}
+    _jobs.put(job)
+
+    return job['id']
+
+
+def status(job_id):
+
+    return _status.get(job_id)
+
+
+def forget(job_id):
+
+    # Drop a finished submission once the session has shown its outcome
+    return _status.pop(job_id, None)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Visitor statistics: counts per dept, product, SAM and hour, kept per dataset.
+
+The counts of a dataset are built once from its frame, then updated by
+every visitor appended from this process, and by the rows other processes
+appended since (visitor_store.changes_since). Cached counts are replaced,
+never changed, so pages read them without the lock. The analytics page
+charts these few hundred counts, not the visitors.
+"""
+import threading
+from collections import Counter
+
+import pandas as pd
+
+import visitor_metrics
+import visitor_store
+
+BUCKET_FORMAT = '%Y-%m-%d %H:00'
+COUNT_COLUMNS = ['dept', 'product', 'sales', 'date']
+
+# {path: (version, {column: Counter})}
+_aggregates = {}
+_lock = threading.Lock()
+
+
+def time_bucket(date):
+
+    # Visitors are counted per hour
+    date = visitor_store.parse_date(date)
+
+    return None if date is None else date.strftime(BUCKET_FORMAT)
+
+
+def build_counts(df):
+
+    # One value_counts per column
+    counts = {'visitors': Counter({'all': len(df)})}
+
+    for column in COUNT_COLUMNS:
+
+        if column == 'product':
+            series = df['product'].explode()
+        elif column == 'date':
+            # Formatted once per hour bucket, not once per visitor
+            series = df['date'].dt.floor('h')
+        else:
+            series = df[column]
+
+        # Categorical columns are counted on their codes, unused categories dropped
+        counts[column] = Counter()
+        for value, count in series.value_counts().items():
+            if count:
+                counts[column][value.strftime(BUCKET_FORMAT) if column == 'date' else str(value)] += int(count)
+
+    return counts
+
+
+def add_counts(counts, df):
+
+    # Counts of some new rows added to existing counts
+    for column, counter in build_counts(df).items():
+        counts[column].update(counter)
+
+    return counts
+
+
+def copy_counts(counts):
+
+    # Cached counts are never changed once shared (merge_counts reads them without the lock): updates go to a copy
+    return {column: Counter(counter) for column, counter in counts.items()}
+
+
+def _add(counts, data):
+
+    counts['visitors']['all'] += 1
+
+    for column in COUNT_COLUMNS:
+
+        value = data.get(column)
+
+        if column == 'product':
+            values = visitor_store.parse_products(value)
+        elif value is None or value == '':
+            values = []
+        elif column == 'date':
+            values = [bucket for bucket in [time_bucket(value)] if bucket is not None]
+        else:
+            values = [str(value)]
+
+        counts[column].update(values)
+
+
+def on_append(path, before, after, rows):
+
+    # Keep the counts of a dataset in step with the appends of this process (load_counts follows the others)
+    with _lock:
+
+        cached = _aggregates.get(path)
+
+        if cached is None:
+            return
+
+        if cached[0] != before:
+            # Written by someone else in between: rebuild on next read
+            del _aggregates[path]
+            return
+
+        counts = copy_counts(cached[1])
+        for data in rows:
+            _add(counts, data)
+        _aggregates[path] = (after, counts)
+
+
+visitor_store.add_listener(on_append)
+
+
+def load_counts(path):
+
+    version = visitor_store.store_version(path)
+
+    with _lock:
+        cached = _aggregates.get(path)
+        if cached is not None and cached[0] == version:
+            visitor_metrics.cache('visitor_counts', True)
+            return cached[1]
+
+    visitor_metrics.cache('visitor_counts', False)
+
+    if cached is not None:
+        # Written by another process: count the new rows only
+        version, rows = visitor_store.changes_since(path, cached[0])
+        if rows is not None:
+            counts = add_counts(copy_counts(cached[1]), rows)
+            with _lock:
+                if _aggregates.get(path) is cached:
+                    _aggregates[path] = (version, counts)
+                    return counts
+
+    version, df = visitor_store.versioned_store(path)
+    counts = build_counts(df)
+
+    with _lock:
+        _aggregates[path] = (version, counts)
+
+    return counts
+
+
+def merge_counts(paths):
+
+    # Counts of several datasets added together
+    merged = {column: Counter() for column in ['visitors'] + COUNT_COLUMNS}
+
+    for path in paths:
+        for column, counter in load_counts(path).items():
+            merged[column].update(counter)
+
+    return merged
+
+
+def count_frame(counts, column):
+
+    # Counter -> DataFrame [column, count], sorted by value
+    df = pd.DataFrame(sorted(counts[column].items()), columns=[column, 'count'])
+
+    return df
@@ -0,0 +1,1113 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Visitor store: append-only datasets shared by every Streamlit session.
+
+New visitors are appended to a small journal file next to the dataset
+(`<dataset>.journal`) under an exclusive file lock, so a submission costs
+one short write whatever the size of the dataset. Readers see the dataset
+plus its journal. The journal is folded back into the dataset once it grows
+past COMPACT_BYTES.
+
+The backend is chosen from the dataset extension:
+- `.csv`: semicolon separated text, as exported by the app,
+- `.parquet`: columnar file, categorical columns and a real list for
+  `product` (run `python visitor_store.py parquet <dataset.csv>`),
+- `.sqlite`: SQLite database in WAL mode, visitors are INSERTed directly
+  and filters are pushed down to indexed SQL queries
+  (run `python visitor_store.py sqlite <dataset.csv>`).
+All return the same frame: `product` is always a list of products and
+`date` a datetime column. Dates are stored as ISO text (DATE_FORMAT), the
+'dd/mm/YYYY, HH:MM:SS' text of older rows is still read.
+"""
+import ast
+import csv
+import io
+import json
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import visitor_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is available
+    fcntl = None
+
+try:
+    import pyarrow
+except ImportError:  # Parquet datasets are optional
+    pyarrow = None
+
+STORE_SEP = ';'
+STORE_COLUMNS = ['date', 'sales', 'farm', 'name', 'address', 'zip', 'dept', 'city',
+                 'mobile', 'cows', 'eqt', 'brand', 'product', 'lat', 'lon']
+# Text everywhere (zip, dept and mobile keep their leading zeros), cows is parsed leniently in _typed
+STORE_DTYPES = {column: str for column in STORE_COLUMNS}
+STORE_DTYPES.update({'lat': 'float64', 'lon': 'float64'})
+CATEGORY_COLUMNS = ['sales', 'dept', 'eqt', 'brand', 'city']
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+LEGACY_DATE_FORMAT = '%d/%m/%Y, %H:%M:%S'
+JOURNAL_SUFFIX = '.journal'
+LOCK_SUFFIX = '.lock'
+SQLITE_EXTENSIONS = ('.sqlite', '.db')
+SQLITE_INDEXES = ['sales', 'dept', 'date', 'zip']
+SQLITE_TIMEOUT = 10
+COMPACT_BYTES = 256 * 1024
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_FORMATS = {'CSV': '.csv', 'CSV (gzip)': '.csv.gz', 'Parquet': '.parquet'}
+
+# Streamlit sessions are threads of the same process, flock covers other processes
+_thread_lock = threading.RLock()
+
+# Parsed datasets: {path: (version, DataFrame)}
+_frames = {}
+
+# Dates of the parsed datasets in ascending order: {path: (frame, sorted dates, row positions)}
+_date_orders = {}
+
+# SQLite databases whose schema was checked by this process
+_sqlite_ready = set()
+
+# Called after every append with (path, version before, version after, list of visitors)
+_listeners = []
+_append_lock = threading.Lock()
+
+
+def journal_path(path):
+
+    return path + JOURNAL_SUFFIX
+
+
+@contextmanager
+def store_lock(path, shared=False):
+
+    # Serialize writers (and keep readers away from half-written rows)
+    with _thread_lock:
+
+        if fcntl is None:
+            yield
+            return
+
+        with open(path + LOCK_SUFFIX, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def parse_date(value):
+
+    # ISO text, legacy form text, datetime or Timestamp -> Timestamp (None if unparsable)
+    if is_missing(value):
+        return None
+
+    if isinstance(value, str):
+        for date_format in (DATE_FORMAT, LEGACY_DATE_FORMAT):
+            try:
+                return pd.Timestamp(datetime.datetime.strptime(value, date_format))
+            except ValueError:
+                pass
+        try:
+            return pd.Timestamp(value)
+        except ValueError:
+            return None
+
+    return pd.Timestamp(value)
+
+
+def format_date(value):
+
+    # Text stored in the datasets
+    date = parse_date(value)
+
+    if date is None:
+        return value if isinstance(value, str) else None
+
+    return date.strftime(DATE_FORMAT)
+
+
+def parse_dates(series):
+
+    # Vectorized parse_date: ISO first, then the legacy form text for what is left
+    dates = pd.to_datetime(series, format='ISO8601', errors='coerce')
+    legacy = dates.isna() & series.notna()
+
+    if legacy.any():
+        dates[legacy] = pd.to_datetime(series[legacy], format=LEGACY_DATE_FORMAT, errors='coerce')
+
+    return dates
+
+
+def is_missing(value):
+
+    # None, NaN, NA or NaT (lists are never missing)
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value)
+
+
+def _format_row(data, columns=STORE_COLUMNS):
+
+    # Same text as pandas.to_csv would have produced for this row
+    data = dict(data, date=format_date(data.get('date')))
+    row = ['' if is_missing(data.get(column)) else data.get(column) for column in columns]
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=STORE_SEP, lineterminator='\n').writerow(row)
+
+    return buffer.getvalue()
+
+
+def _write_header(path, columns=STORE_COLUMNS):
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(STORE_SEP.join(columns) + '\n')
+
+
+def _data_lines(path):
+
+    # Return the rows of a store file without its header line
+    if not os.path.isfile(path):
+        return ''
+
+    with open(path, encoding='utf-8', newline='') as f:
+        f.readline()
+        return f.read()
+
+
+def parse_products(value):
+
+    # "['Nano', 'Moov']" (CSV text) -> ['Nano', 'Moov']
+    if isinstance(value, list):
+        return value
+
+    if not isinstance(value, str) or value == '':
+        return []
+
+    try:
+        products = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return [value]
+
+    return list(products) if isinstance(products, (list, tuple)) else [str(products)]
+
+
+def _typed(df):
+
+    # Free text in the 'Nb vaches' field must not break the whole column
+    df['cows'] = pd.to_numeric(df['cows'], errors='coerce').round().astype('Int64')
+    df['product'] = [parse_products(value) for value in df['product']]
+    df['date'] = parse_dates(df['date'])
+
+    return df
+
+
+def _parse_csv(text):
+
+    return _typed(pd.read_csv(io.StringIO(text), sep=STORE_SEP, dtype=STORE_DTYPES))
+
+
+class CsvStore:
+
+    # Semicolon separated dataset, rows of the journal are appended as is
+
+    def __init__(self, path):
+
+        self.path = path
+        self.journal = journal_path(path)
+
+    def create(self):
+
+        _write_header(self.path)
+
+    def append(self, rows):
+
+        # Append visitors to the journal of the dataset in one write: O(1) in dataset size
+        # Return the versions (before, after) read under the lock, no other writer in between
+        line = ''.join(_format_row(data) for data in rows)
+
+        with store_lock(self.path):
+
+            if not os.path.isfile(self.path):
+                self.create()
+
+            if not os.path.isfile(self.journal):
+                _write_header(self.journal)
+
+            before = self.version()
+
+            with open(self.journal, 'a', encoding='utf-8', newline='') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.path.getsize(self.journal) >= COMPACT_BYTES:
+                _compact(self)
+
+            return before, self.version()
+
+    def version(self):
+
+        # Changes whenever the dataset or its journal is written
+        version = []
+
+        for f in (self.path, self.journal):
+            try:
+                stat = os.stat(f)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                version.append(None)
+
+        return tuple(version)
+
+    def snapshot(self):
+
+        # (version, rows) read while no writer can slip in between
+        with store_lock(self.path, shared=True):
+            return self.version(), self.read()
+
+    def changes(self, since):
+
+        # (version, journal rows appended since version `since`), rows are None when the base file was rewritten
+        with store_lock(self.path, shared=True):
+
+            version = self.version()
+
+            if since is None or since[0] != version[0] or (version[1] is None and since[1] is not None):
+                return version, None
+
+            if version[1] is None or since == version:
+                # No journal yet, or nothing written since
+                return version, _parse_csv(STORE_SEP.join(STORE_COLUMNS) + '\n')
+
+            start = since[1][1] if since[1] is not None else 0
+            end = version[1][1]
+
+            if end < start:
+                return version, None
+
+            with open(self.journal, 'rb') as f:
+                header = len(f.readline())
+                f.seek(max(start, header))
+                text = f.read(end - max(start, header)).decode('utf-8')
+
+        return version, _parse_csv(STORE_SEP.join(STORE_COLUMNS) + '\n' + text)
+
+    def versioned_query(self, filters=None, date_range=None):
+
+        # Filter the cached frame in pandas, dates by binary search
+        version, df = versioned_store(self.path)
+
+        if date_range is not None:
+            df = _date_slice(self.path, df, date_range)
+
+        return version, _filter(df, filters)
+
+    def query(self, filters=None, date_range=None):
+
+        return self.versioned_query(filters, date_range)[1]
+
+    def distinct(self, column):
+
+        return _distinct(load_store(self.path), column)
+
+    def date_bounds(self):
+
+        dates = load_store(self.path)['date']
+
+        return dates.min(), dates.max()
+
+    def compact(self):
+
+        rows = _data_lines(self.journal)
+
+        if rows:
+            with open(self.path, 'a', encoding='utf-8', newline='') as f:
+                f.write(rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_base(self):
+
+        with open(self.path, encoding='utf-8', newline='') as f:
+            return _parse_csv(f.read())
+
+    def write_base(self, df):
+
+        # Lists are written as their Python repr, like the form always did
+        tmp = self.path + '.tmp'
+        df.to_csv(tmp, sep=STORE_SEP, index=False, date_format=DATE_FORMAT)
+        os.replace(tmp, self.path)
+
+    def export(self):
+
+        if os.path.isfile(self.path):
+            with open(self.path, encoding='utf-8', newline='') as f:
+                text = f.read()
+        else:
+            text = STORE_SEP.join(STORE_COLUMNS) + '\n'
+
+        if text and not text.endswith('\n'):
+            text += '\n'
+
+        return text + _data_lines(self.journal)
+
+    def read(self):
+
+        return _parse_csv(self.export())
+
+    def copy_to(self, out):
+
+        # Stream the dataset and its journal rows to a binary file, without parsing them
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                shutil.copyfileobj(f, out)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        out.write(b'\n')
+        else:
+            out.write((STORE_SEP.join(STORE_COLUMNS) + '\n').encode('utf-8'))
+
+        if os.path.isfile(self.journal):
+            with open(self.journal, 'rb') as f:
+                f.readline()
+                shutil.copyfileobj(f, out)
+
+
+class ParquetStore(CsvStore):
+
+    # Columnar dataset: categoricals for low cardinality columns, list<string> for product
+
+    def create(self):
+
+        empty = pd.DataFrame({column: pd.Series(dtype=STORE_DTYPES.get(column, str)) for column in STORE_COLUMNS})
+        self.write_base(_typed(empty))
+
+    def compact(self):
+
+        if _data_lines(self.journal):
+            self.write_base(pd.concat([self.read_base(), self.read_journal()], ignore_index=True))
+
+    def read_base(self):
+
+        df = pd.read_parquet(self.path)
+        df['product'] = [list(value) if value is not None else [] for value in df['product']]
+
+        return df
+
+    def write_base(self, df):
+
+        df = df.copy()
+        for column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype('category')
+
+        tmp = self.path + '.tmp'
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, self.path)
+
+    def read_journal(self):
+
+        return _parse_csv(STORE_SEP.join(STORE_COLUMNS) + '\n' + _data_lines(self.journal))
+
+    def read(self):
+
+        df = self.read_base()
+
+        if os.path.isfile(self.journal):
+            df = pd.concat([df, self.read_journal()], ignore_index=True)
+
+        return df
+
+    def export(self):
+
+        buffer = io.StringIO()
+        self.read().to_csv(buffer, sep=STORE_SEP, index=False, date_format=DATE_FORMAT)
+
+        return buffer.getvalue()
+
+
+class SqliteStore:
+
+    # SQLite dataset: one row per visitor, product stored as a JSON list
+
+    def __init__(self, path):
+
+        self.path = path
+        self.journal = journal_path(path) # Never written, SQLite has its own WAL
+
+    def connect(self):
+
+        cnx = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+        cnx.execute('PRAGMA journal_mode=WAL')
+        cnx.execute('PRAGMA synchronous=NORMAL')
+
+        return cnx
+
+    def create(self, cnx):
+
+        columns = ', '.join(f'{column} {"REAL" if column in ("lat", "lon") else "TEXT"}' for column in STORE_COLUMNS)
+        cnx.execute(f'CREATE TABLE IF NOT EXISTS visitors (id INTEGER PRIMARY KEY, {columns})')
+
+        for column in SQLITE_INDEXES:
+            cnx.execute(f'CREATE INDEX IF NOT EXISTS idx_visitors_{column} ON visitors ({column})')
+
+        # Rows written before dates were stored as ISO text: 'dd/mm/YYYY, HH:MM:SS'
+        cnx.execute("UPDATE visitors SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) "
+                    "|| 'T' || substr(date, 13, 8) WHERE date GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9], *'")
+
+        # Version counter bumped by every write, used by the caches of the app
+        cnx.execute('CREATE TABLE IF NOT EXISTS meta (version INTEGER NOT NULL)')
+        cnx.execute('INSERT INTO meta (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM meta)')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cnx.execute(f'CREATE TRIGGER IF NOT EXISTS visitors_{event.lower()} AFTER {event} ON visitors '
+                        'BEGIN UPDATE meta SET version = version + 1; END')
+
+    def open(self):
+
+        cnx = self.connect()
+
+        if self.path not in _sqlite_ready:
+            with cnx:
+                self.create(cnx)
+            _sqlite_ready.add(self.path)
+
+        return cnx
+
+    def _rows(self, df):
+
+        for data in df.to_dict('records'):
+            yield self._values(data)
+
+    @staticmethod
+    def _values(data):
+
+        values = []
+
+        for column in STORE_COLUMNS:
+            value = data.get(column)
+            if column == 'product':
+                value = json.dumps(parse_products(value), ensure_ascii=False)
+            elif column == 'date':
+                value = format_date(value)
+            elif is_missing(value):
+                value = None
+            elif column not in ('lat', 'lon'):
+                value = str(value)
+            values.append(value)
+
+        return values
+
+    def _insert_sql(self):
+
+        return f'INSERT INTO visitors ({", ".join(STORE_COLUMNS)}) VALUES ({", ".join("?" * len(STORE_COLUMNS))})'
+
+    def append(self, rows):
+
+        # One transaction for the whole batch, return the versions (before, after) read inside it
+        cnx = self.open()
+
+        try:
+            cnx.execute('BEGIN IMMEDIATE')
+            before = self._version(cnx)
+            cnx.executemany(self._insert_sql(), [self._values(data) for data in rows])
+            after = self._version(cnx)
+            cnx.commit()
+        except BaseException:
+            cnx.rollback()
+            raise
+        finally:
+            cnx.close()
+
+        return before, after
+
+    @staticmethod
+    def _version(cnx):
+
+        # (writes counter, last row id): only inserts happened between two versions when both moved by the same count
+        return tuple(cnx.execute('SELECT version, (SELECT COALESCE(MAX(id), 0) FROM visitors) FROM meta').fetchone())
+
+    def version(self):
+
+        if not os.path.isfile(self.path):
+            return None
+
+        cnx = self.open()
+        version = self._version(cnx)
+        cnx.close()
+
+        return version
+
+    def _select(self, cnx, where='', params=()):
+
+        return _typed(pd.read_sql_query(f'SELECT {", ".join(STORE_COLUMNS)} FROM visitors{where} ORDER BY id', cnx,
+                                        params=params, dtype=STORE_DTYPES))
+
+    def snapshot(self):
+
+        # Version and rows read in one transaction (WAL snapshot)
+        cnx = self.open()
+
+        try:
+            cnx.execute('BEGIN')
+            version = self._version(cnx)
+            df = self._select(cnx)
+            cnx.execute('COMMIT')
+        finally:
+            cnx.close()
+
+        return version, df
+
+    def changes(self, since):
+
+        # (version, rows inserted since version `since`), rows are None after an update or a delete
+        cnx = self.open()
+
+        try:
+            cnx.execute('BEGIN')
+            version = self._version(cnx)
+            rows = None
+            if since is not None:
+                inserted = cnx.execute('SELECT COUNT(*) FROM visitors WHERE id > ?', (since[1],)).fetchone()[0]
+                if version[0] - since[0] == inserted:
+                    rows = self._select(cnx, ' WHERE id > ?', (since[1],))
+            cnx.execute('COMMIT')
+        finally:
+            cnx.close()
+
+        return version, rows
+
+    def versioned_query(self, filters=None, date_range=None):
+
+        # Only the rows matching the filters leave the database, read with their version in one transaction
+        clauses, params = [], []
+
+        if date_range is not None:
+            # ISO text sorts like the dates, the range uses idx_visitors_date
+            start, end = date_range
+            if start is not None:
+                clauses.append('date >= ?')
+                params.append(format_date(start))
+            if end is not None:
+                clauses.append('date < ?')
+                params.append(format_date(end))
+
+        for column, values in (filters or {}).items():
+
+            values = list(values)
+            marks = ', '.join('?' * len(values))
+
+            if len(values) == 0:
+                clauses.append('0')
+            elif column == 'product':
+                clauses.append(f'EXISTS (SELECT 1 FROM json_each(visitors.product) WHERE json_each.value IN ({marks}))')
+            else:
+                clauses.append(f'{column} IN ({marks})')
+            params.extend(str(value) for value in values)
+
+        cnx = self.open()
+
+        try:
+            cnx.execute('BEGIN')
+            version = self._version(cnx)
+            df = self._select(cnx, ' WHERE ' + ' AND '.join(clauses) if clauses else '', params)
+            cnx.execute('COMMIT')
+        finally:
+            cnx.close()
+
+        return version, df
+
+    def query(self, filters=None, date_range=None):
+
+        return self.versioned_query(filters, date_range)[1]
+
+    def distinct(self, column):
+
+        if column == 'product':
+            sql = 'SELECT DISTINCT json_each.value FROM visitors, json_each(visitors.product) ORDER BY 1'
+        else:
+            sql = f'SELECT DISTINCT {column} FROM visitors WHERE {column} IS NOT NULL ORDER BY 1'
+
+        cnx = self.open()
+        values = [row[0] for row in cnx.execute(sql)]
+        cnx.close()
+
+        return values
+
+    def date_bounds(self):
+
+        cnx = self.open()
+        start, end = cnx.execute('SELECT MIN(date), MAX(date) FROM visitors').fetchone()
+        cnx.close()
+
+        return parse_date(start), parse_date(end)
+
+    def compact(self):
+
+        cnx = self.open()
+        cnx.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        cnx.close()
+
+    def read_base(self):
+
+        return self.query()
+
+    def read(self):
+
+        return self.query()
+
+    def write_base(self, df):
+
+        with self.open() as cnx:
+            cnx.execute('DELETE FROM visitors')
+            cnx.executemany(self._insert_sql(), self._rows(df))
+        cnx.close()
+
+    def export(self):
+
+        buffer = io.StringIO()
+        self.read().to_csv(buffer, sep=STORE_SEP, index=False, date_format=DATE_FORMAT)
+
+        return buffer.getvalue()
+
+
+def _intern_products(series):
+
+    # Visitors share a few dozen product combinations: one list object per combination
+    combos = {}
+
+    return pd.Series([combos.setdefault(tuple(products), products) for products in series], index=series.index, dtype=object)
+
+
+def compact_frame(df):
+
+    # Frame shared by the admin sessions: categories for the low cardinality columns, interned product lists
+    df = df.assign(**{column: df[column].astype('category') for column in CATEGORY_COLUMNS})
+    df['product'] = _intern_products(df['product'])
+
+    return df
+
+
+def _product_mask(series, values):
+
+    # Each distinct list object is tested once, interned lists (compact_frame) make it once per combination
+    tested = {}
+    mask = []
+
+    for products in series:
+        key = id(products)
+        if key not in tested:
+            tested[key] = not values.isdisjoint(products)
+        mask.append(tested[key])
+
+    return pd.Series(mask, index=series.index, dtype=bool)
+
+
+def _filter(df, filters):
+
+    # {column: [values]} -> rows whose column is one of the values (any product for 'product')
+    if not filters:
+        return df
+
+    mask = pd.Series(True, index=df.index)
+
+    for column, values in filters.items():
+
+        values = set(values)
+
+        if column == 'product':
+            mask &= _product_mask(df['product'], values)
+        else:
+            mask &= df[column].isin(values)
+
+    # Every row kept: the cached frame itself, no copy
+    if mask.all():
+        return df
+
+    return df[mask]
+
+
+def _date_slice(path, df, date_range):
+
+    # Rows of a cached frame with start <= date < end, found by binary search on its sorted dates
+    cached = _date_orders.get(path)
+
+    if cached is None or cached[0] is not df:
+        dates = df['date'].to_numpy(dtype='datetime64[ns]')
+        order = np.argsort(dates, kind='stable') # NaT last
+        cached = (df, dates[order], order)
+        _date_orders[path] = cached
+
+    _, dates, order = cached
+    start, end = date_range
+
+    first = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'ns'), 'left')
+    last = (~np.isnat(dates)).sum() if end is None else np.searchsorted(dates, np.datetime64(end, 'ns'), 'left')
+
+    if first == 0 and last == len(df):
+        return df
+
+    return df.iloc[np.sort(order[first:last])]
+
+
+def _distinct(df, column):
+
+    series = df[column].explode() if column == 'product' else df[column]
+
+    return sorted(series.dropna().astype(str).unique())
+
+
+def open_store(path):
+
+    # Pick the backend from the dataset extension
+    if path.endswith(SQLITE_EXTENSIONS):
+        return SqliteStore(path)
+
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise RuntimeError(f"pyarrow est requis pour lire {path}")
+        return ParquetStore(path)
+
+    return CsvStore(path)
+
+
+def create_store(path):
+
+    # Empty dataset, whatever the backend
+    store = open_store(path)
+
+    with store_lock(path):
+        if isinstance(store, SqliteStore):
+            store.open().close()
+        elif not os.path.isfile(path):
+            store.create()
+
+
+def add_listener(callback):
+
+    # Let caches (aggregates...) follow the appends made by this process
+    _listeners.append(callback)
+
+
+@visitor_metrics.timed('append_visitors')
+def append_visitors(path, rows):
+
+    # Add visitors at once: a single journal write (files) or a single INSERT transaction (SQLite)
+    store = open_store(path)
+    rows = list(rows)
+
+    if not _listeners:
+        store.append(rows)
+        return
+
+    # The versions around the write come from the store lock: rows appended by another process in between
+    # make `before` differ from the cached version, the listeners then read them again
+    with _append_lock:
+        before, after = store.append(rows)
+
+        for callback in _listeners:
+            callback(path, before, after, rows)
+
+
+def append_visitor(path, data):
+
+    append_visitors(path, [data])
+
+
+def _compact(store):
+
+    # Fold the journal rows into the dataset, then drop the journal
+    store.compact()
+
+    if os.path.isfile(store.journal):
+        os.remove(store.journal)
+
+
+def compact_store(path):
+
+    # Can be called periodically (or from a cron) to merge pending journal rows
+    with store_lock(path):
+        _compact(open_store(path))
+
+
+def fill_coordinates(path, coordinates, key, approximate=None):
+
+    # Set lat/lon of the rows whose key(address, zip, city) is in coordinates, when they have none
+    # or when approximate(lat, lon, zip, city) says they are only the commune centre
+    store = open_store(path)
+
+    with store_lock(path):
+
+        _compact(store)
+        df = store.read_base()
+        filled = 0
+
+        for index, row in df.iterrows():
+
+            missing = pd.isna(row['lat']) or pd.isna(row['lon'])
+            if not missing and (approximate is None or not approximate(row['lat'], row['lon'], row['zip'], row['city'])):
+                continue
+
+            lat, lon = coordinates.get(key(row['address'], row['zip'], row['city']), (None, None))
+            if lat is not None and lon is not None and (missing or (lat, lon) != (row['lat'], row['lon'])):
+                df.loc[index, ['lat', 'lon']] = [lat, lon]
+                filled += 1
+
+        if filled:
+            store.write_base(df)
+
+    return filled
+
+
+@visitor_metrics.timed('read_store')
+def read_store(path):
+
+    # Return the dataset and its pending journal rows as a single DataFrame
+    with store_lock(path, shared=True):
+        df = open_store(path).read()
+
+    if visitor_metrics.ENABLED:
+        visitor_metrics.payload('read_store', int(df.memory_usage(deep=False).sum()))
+
+    return df
+
+
+def store_version(path):
+
+    # Changes whenever the dataset is written
+    return open_store(path).version()
+
+
+@visitor_metrics.timed('read_store')
+def snapshot_store(path):
+
+    # (version, frame) of a whole dataset, no write can slip in between
+    version, df = open_store(path).snapshot()
+
+    if visitor_metrics.ENABLED:
+        visitor_metrics.payload('read_store', int(df.memory_usage(deep=False).sum()))
+
+    return version, df
+
+
+def _concat_compact(df, rows):
+
+    # Same categories on both sides, otherwise concat falls back to object columns
+    for column in CATEGORY_COLUMNS:
+        categories = df[column].cat.categories.union(rows[column].cat.categories)
+        df = df.assign(**{column: df[column].cat.set_categories(categories)})
+        rows = rows.assign(**{column: rows[column].cat.set_categories(categories)})
+
+    return pd.concat([df, rows], ignore_index=True)
+
+
+def _load(path):
+
+    # (version, compact frame): parsed once, then only the rows appended since are read
+    store = open_store(path)
+    version = store.version()
+    cached = _frames.get(path)
+
+    visitor_metrics.cache('store_frames', cached is not None and cached[0] == version)
+
+    if cached is not None and cached[0] == version:
+        return cached
+
+    if cached is not None:
+        version, rows = store.changes(cached[0])
+        if rows is not None:
+            df = _concat_compact(cached[1], compact_frame(rows)) if len(rows) != 0 else cached[1]
+            _frames[path] = (version, df)
+            return version, df
+
+    version, df = snapshot_store(path)
+    df = compact_frame(df)
+    _frames[path] = (version, df)
+
+    return version, df
+
+
+def load_store(path):
+
+    # Parse a dataset only when it changed since the last call, shared by every session in compact form
+    return _load(path)[1]
+
+
+def versioned_store(path):
+
+    # (version, frame) of the same read
+    return _load(path)
+
+
+def changes_since(path, version):
+
+    # (current version, rows appended after `version`), rows are None when the dataset was rewritten since
+    return open_store(path).changes(version)
+
+
+def filter_rows(df, filters=None, date_range=None):
+
+    # Filters of query_stores on any frame (new rows of changes_since...)
+    if date_range is not None:
+        start, end = date_range
+        mask = pd.Series(True, index=df.index)
+        if start is not None:
+            mask &= df['date'] >= start
+        if end is not None:
+            mask &= df['date'] < end
+        df = df[mask]
+
+    return _filter(df, filters)
+
+
+@visitor_metrics.timed('query_stores')
+def versioned_query(paths, filters=None, date_range=None):
+
+    # (versions, rows) of query_stores, each version matches the rows read from its dataset
+    results = [open_store(path).versioned_query(filters, date_range) for path in paths]
+    versions = tuple(version for version, df in results)
+    frames = [df for version, df in results]
+
+    if len(frames) == 1:
+        return versions, frames[0]
+
+    return versions, pd.concat(frames, ignore_index=True)
+
+
+def query_stores(paths, filters=None, date_range=None):
+
+    # Rows of several datasets matching {column: [values]} and start <= date < end, filtered by each backend
+    return versioned_query(paths, filters, date_range)[1]
+
+
+def changes_since_many(paths, versions):
+
+    # Rows appended to several datasets since their versions, None when one of them was rewritten
+    results = [changes_since(path, version) for path, version in zip(paths, versions)]
+
+    if any(rows is None for version, rows in results):
+        return None, None
+
+    return tuple(version for version, rows in results), pd.concat([rows for version, rows in results], ignore_index=True)
+
+
+def distinct_values(paths, column):
+
+    # Sorted values of a column over several datasets (each product for 'product')
+    values = set()
+
+    for path in paths:
+        values.update(open_store(path).distinct(column))
+
+    return sorted(values)
+
+
+def date_bounds(paths):
+
+    # First and last visit over several datasets (None when there is no dated visitor)
+    bounds = [open_store(path).date_bounds() for path in paths]
+    starts = [start for start, end in bounds if start is not None and start is not pd.NaT]
+    ends = [end for start, end in bounds if end is not None and end is not pd.NaT]
+
+    if not starts:
+        return None, None
+
+    return min(starts), max(ends)
+
+
+def _write_csv_chunks(df, out):
+
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        out.write(chunk.to_csv(sep=STORE_SEP, index=False, header=start == 0, date_format=DATE_FORMAT).encode('utf-8'))
+
+
+def _write_parquet_chunks(df, out):
+
+    # One row group per chunk, with a schema inferred from the whole frame
+    import pyarrow.parquet as pq
+
+    schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+
+    with pq.ParquetWriter(out, schema) as writer:
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+            writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+@visitor_metrics.timed('open_export')
+def open_export(paths, export_format='CSV', filters=None, date_range=None):
+
+    # Build an export (see EXPORT_FORMATS) chunk by chunk in memory, returned rewound: st.download_button
+    # reads whatever its callable returns into bytes, and only accepts bytes, BytesIO or real files
+    out = io.BytesIO()
+
+    if export_format == 'CSV' and len(paths) == 1 and not filters and date_range is None:
+        # Whole dataset as CSV: copy the file as it is
+        with store_lock(paths[0], shared=True):
+            store = open_store(paths[0])
+            if type(store) is CsvStore:
+                store.copy_to(out)
+                out.seek(0)
+                return out
+
+    df = query_stores(paths, filters, date_range)
+
+    if export_format == 'Parquet':
+        if pyarrow is None:
+            raise RuntimeError("pyarrow est requis pour l'export Parquet")
+        _write_parquet_chunks(df, out)
+    elif export_format == 'CSV (gzip)':
+        with gzip.GzipFile(fileobj=out, mode='wb') as compressed:
+            _write_csv_chunks(df, compressed)
+    else:
+        _write_csv_chunks(df, out)
+
+    visitor_metrics.payload('open_export', out.tell())
+    out.seek(0)
+
+    return out
+
+
+def convert_store(path, target):
+
+    # Copy a dataset (and its journal) to another backend, e.g. CSV -> Parquet
+    df = read_store(path)
+    store = open_store(target)
+
+    with store_lock(target):
+        store.write_base(df)
+
+    return len(df)
+
+
+def list_stores(data_dir):
+
+    # Datasets of a directory, journals and lock files excluded
+    return sorted(f for f in os.listdir(data_dir) if f.endswith(('.csv', '.parquet') + SQLITE_EXTENSIONS))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 2 and sys.argv[1] in ('parquet', 'sqlite'):
+
+        # Imported here only: visitor_tenants itself imports this module
+        import visitor_tenants
+
+        for dataset in sys.argv[2:]:
+            target = os.path.splitext(dataset)[0] + '.' + sys.argv[1]
+            print(f'{convert_store(dataset, target)} rows written in {target}.')
+            if visitor_tenants.move_partition(dataset, target):
+                print(f'Partition moved to {target} in {visitor_tenants.REGISTRY_FILE}, {dataset} can be archived.')
+            else:
+                print(f'{dataset} is not a partition of {visitor_tenants.REGISTRY_FILE}: register {target} there to use it.')
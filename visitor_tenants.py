@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 10/18/2026
+@author: Yann MARCOLINI
+
+Tenant registry: accounts, organizations (FullwoodJoz, resellers...) and the
+catalog of their partitions, one dataset per organization and per event.
+
+Everything lives in REGISTRY_FILE:
+
+    accounts    login name -> organization, admin flag
+    tenants     organization -> display name, logo, SAM list, current event
+    partitions  [{tenant, event, path}], new visitors go to the partition
+                of the current event of the organization
+
+Partitions of new events are created in data/<tenant>/<event>.<ext>, so a
+new reseller or a new show never adds a file that every merge must load:
+admin pages pick an event and only read the partitions of that event.
+
+    python visitor_tenants.py list
+    python visitor_tenants.py tenant <key> <name> <logo> <sam,sam...> <event>
+    python visitor_tenants.py event <tenant> <event> [csv|parquet|sqlite]
+"""
+import json
+import os
+import re
+import sys
+import threading
+import unicodedata
+
+import visitor_store
+
+REGISTRY_FILE = './data/tenants.json'
+PARTITIONS_DIR = './data/'
+BACKEND_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'sqlite': '.sqlite'}
+
+# (mtime, registry)
+_registry = None
+_lock = threading.RLock()
+
+
+def load_registry(path=REGISTRY_FILE):
+
+    # Read again only when the file changed (CLI or another process)
+    global _registry
+
+    mtime = os.path.getmtime(path)
+
+    with _lock:
+        if _registry is None or _registry[0] != mtime:
+            with open(path, encoding='utf-8') as f:
+                _registry = (mtime, json.load(f))
+
+        return _registry[1]
+
+
+def save_registry(registry, path=REGISTRY_FILE):
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def slug(text):
+
+    # 'SPACE 2025' -> 'space-2025', used in partition file names
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+    return re.sub(r'[^a-z0-9]+', '-', text).strip('-')
+
+
+def accounts():
+
+    return list(load_registry()['accounts'])
+
+
+def account(name):
+
+    # Settings of a login: its organization settings plus 'admin' and 'tenant'
+    registry = load_registry()
+    settings = registry['accounts'][name]
+    tenant = registry['tenants'][settings['tenant']]
+
+    return dict(tenant, tenant=settings['tenant'], admin=settings.get('admin', False))
+
+
+def tenant_name(tenant):
+
+    return load_registry()['tenants'][tenant]['name']
+
+
+def partitions(tenants=None, events=None):
+
+    # Catalog entries, optionally restricted to some organizations and events
+    return [partition for partition in load_registry()['partitions']
+            if (tenants is None or partition['tenant'] in tenants) and (events is None or partition['event'] in events)]
+
+
+def events():
+
+    # Events of the catalog, in the order their first partition was registered (latest last)
+    found = []
+
+    for partition in load_registry()['partitions']:
+        if partition['event'] not in found:
+            found.append(partition['event'])
+
+    return found
+
+
+def current_events():
+
+    # Events the organizations are recording visitors for now
+    return sorted({tenant['event'] for tenant in load_registry()['tenants'].values()})
+
+
+def label(partition):
+
+    return f"{tenant_name(partition['tenant'])} - {partition['event']}"
+
+
+def partition_path(tenant, event):
+
+    for partition in partitions([tenant], [event]):
+        return partition['path']
+
+    return None
+
+
+def write_partition(name):
+
+    # Dataset where the visitors recorded by this login are stored
+    settings = account(name)
+    path = partition_path(settings['tenant'], settings['event'])
+
+    if path is None:
+        path = add_partition(settings['tenant'], settings['event'])
+
+    return path
+
+
+def add_partition(tenant, event, backend='csv'):
+
+    # Register (and create) the dataset of an organization for an event
+    with _lock:
+
+        path = partition_path(tenant, event)
+
+        if path is None:
+            directory = os.path.join(PARTITIONS_DIR, slug(tenant))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, slug(event) + BACKEND_EXTENSIONS[backend])
+            visitor_store.create_store(path)
+
+            registry = load_registry()
+            registry['partitions'].append({'tenant': tenant, 'event': event, 'path': path})
+            save_registry(registry)
+
+    return path
+
+
+def move_partition(path, target):
+
+    # Point the partitions stored in `path` to `target` (dataset converted to another backend), return their number
+    with _lock:
+
+        registry = load_registry()
+        moved = 0
+
+        for partition in registry['partitions']:
+            if os.path.normpath(partition['path']) == os.path.normpath(path):
+                partition['path'] = target
+                moved += 1
+
+        if moved:
+            save_registry(registry)
+
+    return moved
+
+
+def add_tenant(key, name, logo, sams, event):
+
+    # A new reseller and its login, its password still has to be added to the secrets
+    registry = load_registry()
+    registry['tenants'][key] = {'name': name, 'logo': logo, 'sams': sams, 'event': event}
+    registry['accounts'].setdefault(name, {'tenant': key})
+    save_registry(registry)
+
+    return add_partition(key, event)
+
+
+def set_event(tenant, event, backend='csv'):
+
+    # Start a new show: the following visitors of the organization go to a new partition
+    path = add_partition(tenant, event, backend)
+
+    registry = load_registry()
+    registry['tenants'][tenant]['event'] = event
+    save_registry(registry)
+
+    return path
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) == 7 and sys.argv[1] == 'tenant':
+        print(add_tenant(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5].split(','), sys.argv[6]))
+    elif len(sys.argv) in (4, 5) and sys.argv[1] == 'event':
+        print(set_event(*sys.argv[2:]))
+    else:
+        for partition in partitions():
+            print(f"{partition['tenant']:<15} {partition['event']:<15} {partition['path']}")